@@ -0,0 +1,72 @@
+# Inputs, latency statistics and baseline checks shared by the benchmark scripts.
+import json
+import sys
+
+import numpy as np
+
+SAMPLE_TEXT = (
+    "The committee met on Tuesday to review the budget for the next year and after a long discussion the members "
+    "agreed to postpone the final vote. Most of the proposals were accepted but the plan to renovate the library was "
+    "sent back for more work because the costs were unclear. In the meantime the staff will collect new offers from "
+    "local builders compare the prices and present a short report at the next meeting.\n\n"
+    "When the weather is good the park near the river is full of people who walk run or ride their bikes along the "
+    "water. On weekends there is a small market where farmers sell fruit vegetables cheese and fresh bread. Children "
+    "play on the grass while their parents sit in the shade talk with friends and enjoy the quiet afternoon.\n\n"
+    "If you want to learn a new language you should practice a little every day instead of studying for many hours "
+    "once a week. Reading short stories listening to podcasts and speaking with native speakers will help you "
+    "remember new words. However it is also important to review the grammar from time to time so that you do not "
+    "repeat the same mistakes."
+)
+
+
+def make_texts(length: int, count: int) -> list[str]:
+    # Texts of about `length` characters cut at word boundaries, every text starts at a different word.
+    words = SAMPLE_TEXT.replace("\n\n", " \n\n ").split(" ")
+    texts = []
+    for i in range(count):
+        start = (i * 7) % len(words)
+        selected = []
+        while sum(len(word) + 1 for word in selected) < length:
+            selected.append(words[(start + len(selected)) % len(words)])
+        text = " ".join(selected).replace(" \n\n ", "\n\n").strip()
+        texts.append(text.rstrip(".") + ".")
+    return texts
+
+
+def summarize(latencies: list[float], items: int, secs: float) -> dict:
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "items_per_sec": items / secs,
+    }
+
+
+def find_regressions(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    # Latencies may not grow and throughput may not drop by more than `tolerance` against the baseline.
+    regressions = []
+    for name, stats in report.items():
+        if name not in baseline:
+            continue
+        for key, value in stats.items():
+            reference = baseline[name].get(key)
+            if reference is None:
+                continue
+            if key.endswith("_ms") and value > reference * (1 + tolerance):
+                regressions.append(f"{name} {key}: {value:.1f} vs {reference:.1f}")
+            elif key == "items_per_sec" and value < reference * (1 - tolerance):
+                regressions.append(f"{name} {key}: {value:.1f} vs {reference:.1f}")
+    return regressions
+
+
+def finish(report: dict, output: str = None, baseline: str = None, tolerance: float = 0.2):
+    print(json.dumps(report, indent=2))
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            regressions = find_regressions(report, json.load(f), tolerance)
+        if regressions:
+            sys.exit("Performance regressions:\n" + "\n".join(regressions))
@@ -0,0 +1,90 @@
+# In-process load test of the FastAPI service, requests go through the app and its batch scheduler without sockets.
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+from loguru import logger
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "deploy"))
+
+import app as service  # noqa: E402
+from comma_fixer import CommaFixer  # noqa: E402
+from common import finish, make_texts, summarize  # noqa: E402
+from scheduler import BatchScheduler  # noqa: E402
+
+parser = argparse.ArgumentParser(prog="Load test the comma placement service in-process.")
+parser.add_argument("--model", type=str, default="just097/roberta-base-lora-comma-placement-r-16-alpha-32")
+parser.add_argument("--device", default="cpu")
+parser.add_argument("--cache_dir", type=str, default=None, help="Merged model cache.")
+parser.add_argument("--lengths", nargs="+", type=int, default=[32, 512, 2048], help="Text lengths in chars.")
+parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32], help="Requests in flight.")
+parser.add_argument("--batch_texts", type=int, default=16, help="Texts per request to POST /batch.")
+parser.add_argument("--requests", type=int, default=64, help="Measured requests per configuration.")
+parser.add_argument("--max_wait_ms", type=float, default=5.0)
+parser.add_argument("--max_batch_size", type=int, default=32)
+parser.add_argument("--max_batch_tokens", type=int, default=4096)
+parser.add_argument("--output", type=str, default=None, help="Write the report as JSON to this path.")
+parser.add_argument("--baseline", type=str, default=None, help="Fail if slower than this JSON report.")
+parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline.")
+
+
+async def run_case(client: httpx.AsyncClient, path: str, payloads: list[dict], concurrency: int) -> list[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def send(payload: dict):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(path, json=payload)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[send(payload) for payload in payloads])
+    return latencies
+
+
+async def measure(args) -> dict:
+    report = {}
+    transport = httpx.ASGITransport(app=service.app)
+    async with service.lifespan(service.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for length in args.lengths:
+                texts = make_texts(length, args.requests * args.batch_texts)
+                cases = [
+                    ("single", "/", [{"input_text": text} for text in texts[: args.requests]], 1),
+                    (
+                        "batch",
+                        "/batch",
+                        [
+                            {"texts": texts[i * args.batch_texts : (i + 1) * args.batch_texts]}
+                            for i in range(args.requests)
+                        ],
+                        args.batch_texts,
+                    ),
+                ]
+                for endpoint, path, payloads, items_per_request in cases:
+                    # One warm-up request per endpoint, so the first forward pass is not measured.
+                    await client.post(path, json=payloads[0])
+                    for concurrency in args.concurrency:
+                        start = time.perf_counter()
+                        latencies = await run_case(client, path, payloads, concurrency)
+                        secs = time.perf_counter() - start
+                        name = f"http/{endpoint}/length={length}/concurrency={concurrency}"
+                        report[name] = summarize(latencies, len(payloads) * items_per_request, secs)
+                        print(name, report[name], file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    # Request logs would dominate the measured latencies.
+    logger.remove()
+    service.comma_fixer = CommaFixer(args.model, args.device, cache_dir=args.cache_dir)
+    service.scheduler = BatchScheduler(
+        service.comma_fixer, args.max_wait_ms, args.max_batch_size, args.max_batch_tokens
+    )
+    finish(asyncio.run(measure(args)), args.output, args.baseline, args.tolerance)
@@ -0,0 +1,85 @@
+# Latency and throughput of CommaFixer over input lengths, batch sizes, thread counts and backends.
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from common import finish, make_texts, summarize  # noqa: E402
+
+from comma_placement.comma_fixer import CommaFixer  # noqa: E402
+
+parser = argparse.ArgumentParser(prog="Benchmark CommaFixer inference.")
+parser.add_argument("--model", type=str, default="just097/roberta-base-lora-comma-placement-r-16-alpha-32")
+parser.add_argument("--onnx_model", type=str, default=None, help="Exported ONNX model, needed for the onnx backend.")
+parser.add_argument("--device", default="cpu")
+parser.add_argument("--cache_dir", type=str, default=None, help="Merged model cache.")
+parser.add_argument("--backends", nargs="+", choices=["torch", "torch-int8", "torch-fast", "onnx"], default=["torch"])
+parser.add_argument("--lengths", nargs="+", type=int, default=[32, 128, 512, 2048], help="Text lengths in chars.")
+parser.add_argument("--batch_sizes", nargs="+", type=int, default=[1, 8, 32], help="Texts per call.")
+parser.add_argument("--threads", nargs="+", type=int, default=[torch.get_num_threads()])
+parser.add_argument("--iterations", type=int, default=20, help="Measured calls per configuration.")
+parser.add_argument("--warmup", type=int, default=2, help="Unmeasured calls per configuration.")
+parser.add_argument("--output", type=str, default=None, help="Write the report as JSON to this path.")
+parser.add_argument("--baseline", type=str, default=None, help="Fail if slower than this JSON report.")
+parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline.")
+
+
+def load_comma_fixer(args, backend: str, num_threads: int) -> CommaFixer:
+    if backend == "onnx":
+        return CommaFixer(args.onnx_model, "cpu", backend="onnx", intra_op_threads=num_threads)
+    torch.set_num_threads(num_threads)
+    comma_fixer = CommaFixer(
+        args.model,
+        args.device,
+        cache_dir=args.cache_dir,
+        quantize=backend == "torch-int8",
+        fast=backend == "torch-fast",
+    )
+    # Compile time is a startup cost, it should not show up in the measured latencies.
+    comma_fixer.warmup()
+    return comma_fixer
+
+
+def run_case(comma_fixer: CommaFixer, texts: list[str], batch_size: int, iterations: int, warmup: int) -> dict:
+    calls = [texts[i * batch_size : (i + 1) * batch_size] for i in range(warmup + iterations)]
+    latencies = []
+    for i, batch in enumerate(calls):
+        start = time.perf_counter()
+        if batch_size == 1:
+            comma_fixer.fix_commas(batch[0])
+        else:
+            comma_fixer.fix_commas_batch(batch, batch_size=batch_size)
+        if i >= warmup:
+            latencies.append(time.perf_counter() - start)
+    return summarize(latencies, iterations * batch_size, sum(latencies))
+
+
+def measure(args) -> dict:
+    report = {}
+    for backend in args.backends:
+        comma_fixer = None
+        for num_threads in args.threads:
+            # Torch threads can change on a loaded model, an ONNX session fixes them when it is created.
+            if comma_fixer is None or backend == "onnx":
+                comma_fixer = load_comma_fixer(args, backend, num_threads)
+            else:
+                torch.set_num_threads(num_threads)
+            for length in args.lengths:
+                for batch_size in args.batch_sizes:
+                    texts = make_texts(length, (args.warmup + args.iterations) * batch_size)
+                    name = f"{backend}/threads={num_threads}/length={length}/batch={batch_size}"
+                    report[name] = run_case(comma_fixer, texts, batch_size, args.iterations, args.warmup)
+                    print(name, report[name], file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if "onnx" in args.backends and args.onnx_model is None:
+        parser.error("--onnx_model is required for the onnx backend.")
+    finish(measure(args), args.output, args.baseline, args.tolerance)
@@ -0,0 +1,62 @@
+# Measures how long a fresh process needs to import the package and to produce its first prediction.
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+from common import finish
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import comma_placement.comma_fixer
+print(time.perf_counter() - start)
+"""
+
+FIRST_PREDICTION_SNIPPET = """
+import time
+start = time.perf_counter()
+from comma_placement.comma_fixer import CommaFixer
+comma_fixer = CommaFixer({model!r}, {device!r}, cache_dir={cache_dir!r})
+loaded = time.perf_counter()
+comma_fixer.fix_commas("One two three.")
+print(loaded - start, time.perf_counter() - start)
+"""
+
+parser = argparse.ArgumentParser(prog="Benchmark import time and time to the first prediction.")
+parser.add_argument("--model", type=str, default="just097/roberta-base-lora-comma-placement-r-16-alpha-32")
+parser.add_argument("--device", default="cpu")
+parser.add_argument("--cache_dir", type=str, default=None, help="Merged model cache to measure warm starts.")
+parser.add_argument("--repeats", type=int, default=5)
+parser.add_argument("--output", type=str, default=None, help="Write the report as JSON to this path.")
+parser.add_argument("--baseline", type=str, default=None, help="Fail if slower than this JSON report.")
+parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline.")
+
+
+def run_snippet(snippet: str) -> list[float]:
+    output = subprocess.run(
+        [sys.executable, "-c", snippet], cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    return [float(value) for value in output.split()[-2:] if value]
+
+
+def measure(args) -> dict:
+    import_secs = [run_snippet(IMPORT_SNIPPET)[-1] for _ in range(args.repeats)]
+    snippet = FIRST_PREDICTION_SNIPPET.format(model=args.model, device=args.device, cache_dir=args.cache_dir)
+    load_secs, first_prediction_secs = zip(*[run_snippet(snippet) for _ in range(args.repeats)])
+    # Median times in the same format as the other benchmarks, so `finish` compares them with the baseline.
+    return {
+        "startup": {
+            "import_ms": statistics.median(import_secs) * 1000,
+            "load_ms": statistics.median(load_secs) * 1000,
+            "first_prediction_ms": statistics.median(first_prediction_secs) * 1000,
+        }
+    }
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    finish(measure(args), args.output, args.baseline, args.tolerance)
@@ -0,0 +1,107 @@
+# Streaming pipeline to restore commas in large text or JSONL files with bounded memory.
+import json
+import sys
+import time
+from collections import deque
+from typing import Iterable, Iterator, Optional, TextIO
+
+
+def read_records(stream: TextIO, input_format: str = "text", text_field: str = "text") -> Iterator[tuple]:
+    # Every line is one document. JSONL records keep all their fields for the output.
+    for line in stream:
+        line = line.rstrip("\n")
+        if input_format == "jsonl":
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield record, record[text_field]
+        else:
+            yield None, line
+
+
+def batch_records(records: Iterable[tuple], max_docs: int, max_chars: Optional[int] = None) -> Iterator[list]:
+    batch, chars = [], 0
+    for record in records:
+        if batch and (len(batch) == max_docs or (max_chars is not None and chars + len(record[1]) > max_chars)):
+            yield batch
+            batch, chars = [], 0
+        batch.append(record)
+        chars += len(record[1])
+    if batch:
+        yield batch
+
+
+def fix_batches(comma_fixer, batches: Iterable[list]) -> Iterator[list]:
+    if not hasattr(comma_fixer, "imap_batches"):
+        for batch in batches:
+            fixed = comma_fixer.fix_commas_batch([text for _, text in batch])
+            yield [(record, text, fixed_text) for (record, text), fixed_text in zip(batch, fixed)]
+        return
+
+    # A worker pool keeps several batches in flight and returns them in order.
+    pending = deque()
+
+    def texts():
+        for batch in batches:
+            pending.append(batch)
+            yield [text for _, text in batch]
+
+    for fixed in comma_fixer.imap_batches(texts()):
+        batch = pending.popleft()
+        yield [(record, text, fixed_text) for (record, text), fixed_text in zip(batch, fixed)]
+
+
+def write_results(
+    stream: TextIO,
+    results: Iterable[list],
+    output_format: str = "text",
+    output_field: str = "text_with_commas",
+    report_every: float = 10.0,
+) -> dict:
+    stats = {"docs": 0, "chars": 0, "secs": 0.0}
+    start = last_report = time.time()
+    for batch in results:
+        for record, text, fixed_text in batch:
+            if output_format == "jsonl":
+                record = dict(record or {"text": text})
+                record[output_field] = fixed_text
+                stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+            else:
+                stream.write(fixed_text + "\n")
+            stats["docs"] += 1
+            stats["chars"] += len(text)
+        stream.flush()
+        if report_every and time.time() - last_report >= report_every:
+            last_report = time.time()
+            report_progress(stats, last_report - start)
+    stats["secs"] = time.time() - start
+    return stats
+
+
+def report_progress(stats: dict, secs: float, final: bool = False):
+    prefix = "Done" if final else "Progress"
+    print(
+        f"{prefix}: {stats['docs']} docs, {stats['chars']} chars in {secs:.1f} secs "
+        f"({stats['docs'] / max(secs, 1e-9):.1f} docs/sec, {stats['chars'] / max(secs, 1e-9):.0f} chars/sec)",
+        file=sys.stderr,
+    )
+
+
+def run_bulk(
+    comma_fixer,
+    input_stream: TextIO,
+    output_stream: TextIO,
+    input_format: str = "text",
+    text_field: str = "text",
+    output_field: str = "text_with_commas",
+    max_docs: int = 64,
+    max_chars: Optional[int] = 65536,
+    report_every: float = 10.0,
+) -> dict:
+    # Each stage is a generator, so only one batch of documents is held in memory at a time.
+    records = read_records(input_stream, input_format, text_field)
+    batches = batch_records(records, max_docs, max_chars)
+    results = fix_batches(comma_fixer, batches)
+    stats = write_results(output_stream, results, input_format, output_field, report_every)
+    report_progress(stats, stats["secs"], final=True)
+    return stats
@@ -1,12 +1,15 @@
 # Some constants and params for data processing, training and evaluating
-from peft import LoraConfig, TaskType
-from transformers import TrainingArguments
+import functools
+import os
 
-RAW_DATA = "../data/raw"
-PROCESSED_DATA = "../data/processed"
+# Paths are relative to the repository, so scripts in this directory and `python -m comma_placement.*` share them.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RAW_DATA = f"{ROOT}/data/raw"
+PROCESSED_DATA = f"{ROOT}/data/processed"
 
 DATASET_NAME = "wiki-comma-placement"
 DATASET_PATH = f"{PROCESSED_DATA}/{DATASET_NAME}"
+TOKENIZED_DATA = f"{PROCESSED_DATA}/tokenized"
 
 
 ID2LABEL = {0: "O", 1: "B-COMMA"}
@@ -17,6 +20,10 @@ base_model = "roberta-base"
 lr = 1e-3
 batch_size = 32
 num_epochs = 5
+# Batches of samples with similar lengths waste less compute on padding. Off to reproduce the best experiment.
+group_by_length = False
+# Pack batches up to this many padded tokens instead of `batch_size` samples, None disables it.
+max_tokens_per_batch = None
 
 # Lora
 r = 16
@@ -24,28 +31,62 @@ alpha = 32
 
 dataset_path = f"just097/{DATASET_NAME}"  # My formatted dataset wiki-comma-placement
 model_name = f"roberta-base-lora-comma-placement-r-{r}-alpha-{alpha}"
-checkpoints_path = f"../checkpoints/{model_name}"
-model_path = f"../models/{model_name}"
-
-training_args = TrainingArguments(
-    checkpoints_path,
-    learning_rate=lr,
-    per_device_train_batch_size=batch_size,
-    per_device_eval_batch_size=batch_size,
-    num_train_epochs=num_epochs,
-    weight_decay=1e-4,
-    evaluation_strategy="epoch",
-    save_strategy="epoch",
-    run_name=model_name,
-    logging_steps=1,
-    metric_for_best_model="f1",
-)
-
-peft_config = LoraConfig(
-    task_type=TaskType.TOKEN_CLS,
-    inference_mode=False,
-    r=r,
-    lora_alpha=alpha,
-    lora_dropout=0.1,
-    modules_to_save=["classifier"],
-)
+checkpoints_path = f"{ROOT}/checkpoints/{model_name}"
+model_path = f"{ROOT}/models/{model_name}"
+
+# Distillation
+teacher_model = f"just097/{model_name}"
+student_model = "distilroberta-base"
+student_num_layers = None  # Keep this many evenly spaced layers of the student, None keeps all of them.
+distill_temperature = 2.0
+distill_alpha = 0.5  # Weight of the soft-label loss, the rest goes to the cross-entropy with the tags.
+distill_lr = 5e-5
+student_name = "distilroberta-comma-placement"
+student_checkpoints_path = f"{ROOT}/checkpoints/{student_name}"
+student_path = f"{ROOT}/models/{student_name}"
+
+
+@functools.lru_cache(maxsize=None)
+def _training_args():
+    from transformers import TrainingArguments
+
+    return TrainingArguments(
+        checkpoints_path,
+        learning_rate=lr,
+        per_device_train_batch_size=batch_size,
+        per_device_eval_batch_size=batch_size,
+        num_train_epochs=num_epochs,
+        weight_decay=1e-4,
+        evaluation_strategy="epoch",
+        save_strategy="epoch",
+        run_name=model_name,
+        logging_steps=1,
+        metric_for_best_model="f1",
+        group_by_length=group_by_length,
+        length_column_name="length",
+        # Metrics are summed over eval batches, so predictions of the whole eval set are never held in memory.
+        batch_eval_metrics=True,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _peft_config():
+    from peft import LoraConfig, TaskType
+
+    return LoraConfig(
+        task_type=TaskType.TOKEN_CLS,
+        inference_mode=False,
+        r=r,
+        lora_alpha=alpha,
+        lora_dropout=0.1,
+        modules_to_save=["classifier"],
+    )
+
+
+def __getattr__(name):
+    # Building these pulls in transformers and peft, so it only happens when a script imports them.
+    if name == "training_args":
+        return _training_args()
+    if name == "peft_config":
+        return _peft_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
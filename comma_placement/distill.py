@@ -0,0 +1,176 @@
+import argparse
+import dataclasses
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from config import (
+    ID2LABEL,
+    LABEL2ID,
+    TOKENIZED_DATA,
+    dataset_path,
+    distill_alpha,
+    distill_lr,
+    distill_temperature,
+    max_tokens_per_batch,
+    student_checkpoints_path,
+    student_model,
+    student_name,
+    student_num_layers,
+    student_path,
+    teacher_model,
+    training_args,
+)
+from metrics import StreamingMetrics, preprocess_logits_for_metrics
+from peft import PeftConfig, PeftModel
+from transformers import AutoModelForTokenClassification, AutoTokenizer, DataCollatorForTokenClassification
+from utils.batching import LengthBatchingTrainer
+from utils.data_process import load_tokenized_dataset
+
+parser = argparse.ArgumentParser(prog="Distill the LoRa comma placement model into a smaller student.")
+parser.add_argument("--teacher", type=str, default=teacher_model, help="LoRa adapter id on HF or local path.")
+parser.add_argument("--student", type=str, default=student_model, help="Pretrained student, e.g. distilroberta-base.")
+parser.add_argument("--num_layers", type=int, default=student_num_layers, help="Truncate the student to N layers.")
+parser.add_argument("--temperature", type=float, default=distill_temperature)
+parser.add_argument("--alpha", type=float, default=distill_alpha, help="Weight of the soft-label loss.")
+parser.add_argument("--use_wandb", type=bool, default=False)
+parser.add_argument("--save_to_hf", type=bool, default=False)
+parser.add_argument("--num_proc", type=int, default=None, help="Processes to tokenize the dataset when not cached.")
+parser.add_argument("--report_samples", type=int, default=2000, help="Test samples used to measure tokens/sec.")
+parser.add_argument("--report", type=str, default=None, help="Write the F1 vs tokens/sec report as JSON.")
+
+
+class DistillationTrainer(LengthBatchingTrainer):
+    """Trains the student on the teacher's soft labels mixed with the cross-entropy on the tags."""
+
+    def __init__(self, *args, teacher=None, temperature: float = 2.0, alpha: float = 0.5, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.teacher = teacher.to(self.args.device).eval()
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        outputs = model(**inputs)
+        with torch.no_grad():
+            teacher_logits = self.teacher(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"]).logits
+        # Only the first sub-token of a word carries a tag, the teacher was never trained on the others.
+        mask = inputs["labels"] != -100
+        soft_loss = F.kl_div(
+            F.log_softmax(outputs.logits[mask] / self.temperature, dim=-1),
+            F.softmax(teacher_logits[mask].float() / self.temperature, dim=-1),
+            reduction="batchmean",
+        )
+        loss = self.alpha * soft_loss * self.temperature**2 + (1 - self.alpha) * outputs.loss
+        return (loss, outputs) if return_outputs else loss
+
+
+def load_teacher(teacher: str, base_model: str):
+    model = AutoModelForTokenClassification.from_pretrained(
+        base_model, num_labels=2, id2label=ID2LABEL, label2id=LABEL2ID
+    )
+    return PeftModel.from_pretrained(model, teacher).merge_and_unload()
+
+
+def build_student(student: str, num_layers: int = None):
+    model = AutoModelForTokenClassification.from_pretrained(student, num_labels=2, id2label=ID2LABEL, label2id=LABEL2ID)
+    if num_layers is not None:
+        # Evenly spaced layers keep both the lower and the upper part of the pretrained encoder.
+        layers = model.base_model.encoder.layer
+        keep = np.linspace(0, len(layers) - 1, num_layers).round().astype(int)
+        model.base_model.encoder.layer = torch.nn.ModuleList([layers[i] for i in keep])
+        model.config.num_hidden_layers = num_layers
+    return model
+
+
+@torch.inference_mode()
+def tokens_per_sec(model, dataset, data_collator, batch_size: int) -> float:
+    model.eval()
+    features = dataset.select_columns(["input_ids", "attention_mask"])
+    num_tokens, start = 0, time.perf_counter()
+    for batch_start in range(0, len(features), batch_size):
+        batch = data_collator([features[i] for i in range(batch_start, min(batch_start + batch_size, len(features)))])
+        model(input_ids=batch["input_ids"].to(model.device), attention_mask=batch["attention_mask"].to(model.device))
+        num_tokens += int(batch["attention_mask"].sum())
+    if model.device.type == "cuda":
+        torch.cuda.synchronize()
+    return num_tokens / (time.perf_counter() - start)
+
+
+def report_models(models: dict, eval_args, data_collator, dataset, report_samples: int) -> dict:
+    report = {}
+    sample = dataset.select(range(min(report_samples, len(dataset))))
+    for name, model in models.items():
+        trainer = LengthBatchingTrainer(
+            model=model,
+            args=eval_args,
+            data_collator=data_collator,
+            compute_metrics=StreamingMetrics(),
+            preprocess_logits_for_metrics=preprocess_logits_for_metrics,
+            max_tokens_per_batch=max_tokens_per_batch,
+        )
+        report[name] = {
+            "parameters": sum(parameter.numel() for parameter in model.parameters()),
+            "f1": trainer.predict(dataset).metrics["test_f1"],
+            "tokens_per_sec": tokens_per_sec(model, sample, data_collator, eval_args.eval_batch_size),
+        }
+    for name, row in report.items():
+        speedup = row["tokens_per_sec"] / report["teacher"]["tokens_per_sec"]
+        print(
+            f"{name:>8}: {row['parameters'] / 1e6:.1f}M params, F1 {row['f1']:.4f}, "
+            f"{row['tokens_per_sec']:.0f} tokens/sec ({speedup:.2f}x)"
+        )
+    return report
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    distill_args = dataclasses.replace(
+        training_args,
+        output_dir=student_checkpoints_path,
+        run_name=student_name,
+        learning_rate=distill_lr,
+        fp16=torch.cuda.is_available(),
+        report_to=["wandb"] if args.use_wandb else [],
+    )
+    print(distill_args)
+
+    base_model = PeftConfig.from_pretrained(args.teacher).base_model_name_or_path
+    teacher = load_teacher(args.teacher, base_model)
+    # The student has to split words like the teacher, so both share the teacher's tokenizer and dataset cache.
+    tokenizer = AutoTokenizer.from_pretrained(base_model, add_prefix_space=True)
+    tokenized_wiki = load_tokenized_dataset(dataset_path, tokenizer, TOKENIZED_DATA, args.num_proc)
+    data_collator = DataCollatorForTokenClassification(tokenizer=tokenizer)
+
+    student = build_student(args.student, args.num_layers)
+    trainer = DistillationTrainer(
+        model=student,
+        args=distill_args,
+        train_dataset=tokenized_wiki["train"],
+        eval_dataset=tokenized_wiki["validation"],
+        tokenizer=tokenizer,
+        data_collator=data_collator,
+        compute_metrics=StreamingMetrics(),
+        preprocess_logits_for_metrics=preprocess_logits_for_metrics,
+        max_tokens_per_batch=max_tokens_per_batch,
+        teacher=teacher,
+        temperature=args.temperature,
+        alpha=args.alpha,
+    )
+    trainer.train()
+
+    if args.save_to_hf:
+        student.push_to_hub(student_name)
+        tokenizer.push_to_hub(student_name)
+    else:
+        trainer.save_model(student_path)
+
+    models = {"teacher": teacher, "student": student}
+    report = report_models(models, distill_args, data_collator, tokenized_wiki["test"], args.report_samples)
+    if args.report:
+        os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
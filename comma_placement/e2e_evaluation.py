@@ -0,0 +1,135 @@
+# End-to-end evaluation of the whole CommaFixer pipeline on raw text rebuilt from the test split.
+import argparse
+import json
+import sys
+import time
+
+from .bulk import batch_records, fix_batches
+from .comma_fixer import CommaFixer
+from .config import dataset_path
+from .pool import CommaFixerPool
+from .utils.data_process import remove_spaces
+
+parser = argparse.ArgumentParser(prog="Evaluate CommaFixer end-to-end with character-level comma metrics.")
+parser.add_argument("--model", type=str, default="just097/roberta-base-lora-comma-placement-r-16-alpha-32")
+parser.add_argument("--dataset", type=str, default=dataset_path, help="Dataset with tokens and tags on HF.")
+parser.add_argument("--split", type=str, default="test")
+parser.add_argument("--sentences_per_doc", type=int, default=8, help="Consecutive sentences joined into a document.")
+parser.add_argument("--max_docs", type=int, default=None, help="Only evaluate the first documents.")
+parser.add_argument("--docs_per_batch", type=int, default=64, help="Documents sent to the fixer at once.")
+parser.add_argument("--workers", type=int, default=1, help="Worker processes, 0 uses all cores.")
+parser.add_argument("--threads_per_worker", type=int, default=None, help="Torch threads of each worker process.")
+parser.add_argument("--device", default="cpu")
+parser.add_argument("--batch_size", type=int, default=16, help="Max number of chunks in one forward pass.")
+parser.add_argument("--max_tokens", type=int, default=None, help="Max number of padded tokens in one forward pass.")
+parser.add_argument("--chunking", choices=["sentence", "window"], default="sentence")
+parser.add_argument("--backend", choices=["torch", "onnx"], default="torch", help="ONNX needs an exported model path.")
+parser.add_argument("--quantize", action="store_true", help="Run an int8 dynamically quantized model on cpu.")
+parser.add_argument("--quantized_path", type=str, default=None, help="Where to cache the quantized weights.")
+parser.add_argument("--cache_dir", type=str, default=None, help="Directory for the merged model, reused offline.")
+parser.add_argument("--fast", action="store_true", help="SDPA attention, bf16 autocast and torch.compile.")
+parser.add_argument("--no_bf16", action="store_true", help="Keep fp32 in the fast path, also on bf16 hardware.")
+parser.add_argument("--output", type=str, default=None, help="Write the report as JSON to this path.")
+parser.add_argument("--baseline", type=str, default=None, help="Fail if F1 is lower than in this JSON report.")
+parser.add_argument("--tolerance", type=float, default=0.002, help="Allowed F1 drop against the baseline.")
+
+
+def tokens_to_text(tokens: list[str], tags: list[int]) -> str:
+    # Tagged words get their comma back, spacing around punctuation is normalized like in the raw data.
+    words = [token + "," if tag else token for token, tag in zip(tokens, tags)]
+    return remove_spaces([" ".join(words)])[0]
+
+
+def comma_positions(text: str) -> set[int]:
+    # A comma is identified by the number of characters before it, not counting whitespace and commas,
+    # so positions do not depend on the spacing the fixer produces.
+    positions, num_chars = set(), 0
+    for char in text:
+        if char == ",":
+            positions.add(num_chars)
+        elif not char.isspace():
+            num_chars += 1
+    return positions
+
+
+def content(text: str) -> str:
+    return "".join(char for char in text if char != "," and not char.isspace())
+
+
+def score(references: list[str], predictions: list[str]) -> dict:
+    tp = num_predicted = num_true = altered = 0
+    for reference, prediction in zip(references, predictions):
+        true, predicted = comma_positions(reference), comma_positions(prediction)
+        tp += len(true & predicted)
+        num_predicted += len(predicted)
+        num_true += len(true)
+        # The fixer may only add commas and change whitespace, anything else is a bug in the pipeline.
+        altered += content(reference) != content(prediction)
+    precision = tp / num_predicted if num_predicted else 0.0
+    recall = tp / num_true if num_true else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1, "altered_docs": altered}
+
+
+def load_documents(dataset: str, split: str, sentences_per_doc: int, max_docs: int = None) -> list[str]:
+    from datasets import load_dataset
+
+    rows = load_dataset(dataset, split=split)
+    if max_docs is not None:
+        rows = rows.select(range(min(len(rows), max_docs * sentences_per_doc)))
+    sentences = [tokens_to_text(tokens, tags) for tokens, tags in zip(rows["tokens"], rows["tags"])]
+    return [" ".join(sentences[i : i + sentences_per_doc]) for i in range(0, len(sentences), sentences_per_doc)]
+
+
+def evaluate_e2e(comma_fixer, documents: list[str], docs_per_batch: int = 64) -> dict:
+    # Documents still hold their commas, stripping them is part of the evaluated pipeline.
+    start = time.perf_counter()
+    batches = batch_records(((None, document) for document in documents), docs_per_batch)
+    predictions = [fixed for batch in fix_batches(comma_fixer, batches) for _, _, fixed in batch]
+    secs = time.perf_counter() - start
+    report = score(documents, predictions)
+    report.update(
+        {
+            "docs": len(documents),
+            "secs": secs,
+            "docs_per_sec": len(documents) / secs,
+            "chars_per_sec": sum(len(document) for document in documents) / secs,
+        }
+    )
+    return report
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    fixer_kwargs = dict(
+        batch_size=args.batch_size,
+        max_tokens=args.max_tokens,
+        chunking=args.chunking,
+        backend=args.backend,
+        quantize=args.quantize,
+        quantized_path=args.quantized_path,
+        cache_dir=args.cache_dir,
+        fast=args.fast,
+        bf16=False if args.no_bf16 else None,
+    )
+    if args.workers != 1:
+        comma_fixer = CommaFixerPool(
+            args.model, args.device, args.workers or None, args.threads_per_worker, **fixer_kwargs
+        )
+    else:
+        comma_fixer = CommaFixer(args.model, args.device, **fixer_kwargs)
+
+    documents = load_documents(args.dataset, args.split, args.sentences_per_doc, args.max_docs)
+    report = evaluate_e2e(comma_fixer, documents, args.docs_per_batch)
+    if isinstance(comma_fixer, CommaFixerPool):
+        comma_fixer.close()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if report["f1"] < baseline["f1"] - args.tolerance:
+            sys.exit(f"F1 dropped from {baseline['f1']:.4f} to {report['f1']:.4f}.")
@@ -1,11 +1,14 @@
 import argparse
+import dataclasses
 from pprint import pprint
 
-from .config import dataset_path, training_args
-from datasets import load_dataset
-from comma_fixer import CommaFixer
-from metrics import compute_metrics
-from transformers import DataCollatorForTokenClassification, Trainer
+from transformers import DataCollatorForTokenClassification
+
+from .comma_fixer import CommaFixer
+from .config import TOKENIZED_DATA, dataset_path, max_tokens_per_batch, training_args
+from .metrics import StreamingMetrics, preprocess_logits_for_metrics
+from .utils.batching import LengthBatchingTrainer
+from .utils.data_process import load_tokenized_dataset
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -14,51 +17,43 @@ parser.add_argument(
     default="just097/roberta-base-lora-comma-placement-r-16-alpha-32",
     help="Please provide a model-id on HF",
 )
+parser.add_argument("--dataset", type=str, default=dataset_path, help="Dataset with tokens and tags on HF.")
+parser.add_argument("--quantize", action="store_true", help="Compare the fp32 model with its int8 quantized version.")
+parser.add_argument("--quantized_path", type=str, default=None, help="Where to cache the quantized weights.")
 
 
-model = None
-tokenizer = None
-
-
-def tokenize_and_align_labels(examples):
-    tokenized_inputs = tokenizer(examples["tokens"], truncation=True, is_split_into_words=True)
-
-    labels = []
-    for i, label in enumerate(examples[f"tags"]):
-        word_ids = tokenized_inputs.word_ids(batch_index=i)
-        previous_word_idx = None
-        label_ids = []
-        for word_idx in word_ids:
-            if word_idx is None:
-                label_ids.append(-100)
-            elif word_idx != previous_word_idx:
-                label_ids.append(label[word_idx])
-            else:
-                label_ids.append(-100)
-            previous_word_idx = word_idx
-        labels.append(label_ids)
-
-    tokenized_inputs["labels"] = labels
-    return tokenized_inputs
-
-
-if __name__ == "__main__":
-    args = parser.parse_args()
-    comma_fixer = CommaFixer(args.model, device="cpu")
+def evaluate_test(comma_fixer: CommaFixer, eval_args=training_args, dataset: str = dataset_path) -> dict:
     model, tokenizer = comma_fixer.model, comma_fixer.tokenizer
-    wiki_comma_placement = load_dataset(dataset_path)
-    tokenized_wiki = wiki_comma_placement.map(tokenize_and_align_labels, batched=True)
+    tokenized_wiki = load_tokenized_dataset(dataset, tokenizer, TOKENIZED_DATA)
     data_collator = DataCollatorForTokenClassification(tokenizer=tokenizer)
 
-    trainer = Trainer(
+    trainer = LengthBatchingTrainer(
         model=model,
-        args=training_args,
+        args=eval_args,
         train_dataset=tokenized_wiki["train"],
         eval_dataset=tokenized_wiki["validation"],
         tokenizer=tokenizer,
         data_collator=data_collator,
-        compute_metrics=compute_metrics,
+        compute_metrics=StreamingMetrics(),
+        preprocess_logits_for_metrics=preprocess_logits_for_metrics,
+        max_tokens_per_batch=max_tokens_per_batch,
     )
+    print(f"Test batches: {trainer.padding_report(tokenized_wiki['test'], train=False)}")
+    return trainer.predict(tokenized_wiki["test"])[2]
+
 
+if __name__ == "__main__":
+    args = parser.parse_args()
+    comma_fixer = CommaFixer(args.model, device="cpu")
+    fp32_stats = evaluate_test(comma_fixer, dataset=args.dataset)
     print("TEST statistics:")
-    pprint(trainer.predict(tokenized_wiki["test"])[2], indent=2)
+    pprint(fp32_stats, indent=2)
+
+    if args.quantize:
+        quantized_fixer = CommaFixer(args.model, device="cpu", quantize=True, quantized_path=args.quantized_path)
+        # Quantized kernels only run on cpu, so keep the Trainer from moving the model to a GPU.
+        int8_stats = evaluate_test(quantized_fixer, dataclasses.replace(training_args, use_cpu=True), args.dataset)
+        print("Parity report, fp32 vs int8:")
+        for metric in ["precision", "recall", "f1", "accuracy"]:
+            fp32, int8 = fp32_stats[f"test_{metric}"], int8_stats[f"test_{metric}"]
+            print(f"{metric:>10}: {fp32:.4f} vs {int8:.4f} ({int8 - fp32:+.4f})")
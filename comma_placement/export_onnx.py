@@ -0,0 +1,74 @@
+import argparse
+import os
+
+import numpy as np
+import torch
+
+from .comma_fixer import ONNX_MODEL_NAME, CommaFixer
+
+parser = argparse.ArgumentParser(prog="Export a merged comma placement model to ONNX.")
+parser.add_argument(
+    "--model",
+    type=str,
+    default="just097/roberta-base-lora-comma-placement-r-16-alpha-32",
+    help="Please provide a model-id on HF or local path.",
+)
+parser.add_argument("--output", type=str, default="models/onnx", help="Directory to write the ONNX model to.")
+parser.add_argument("--opset", type=int, default=17)
+
+parity_samples = [
+    "One two three.",
+    "However there is a comma here.",
+    "As the sun dipped below the horizon painting the sky in shades of orange red and purple the tranquility of "
+    "the evening was interrupted by the sudden appearance of a shooting star.",
+]
+
+
+def export_onnx(comma_fixer: CommaFixer, output_dir: str, opset: int = 17) -> str:
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, ONNX_MODEL_NAME)
+    model = comma_fixer.model.to("cpu")
+    dummy = comma_fixer.tokenizer(["One two three.", "Four five."], padding=True, return_tensors="pt")
+    torch.onnx.export(
+        model,
+        (dummy["input_ids"], dummy["attention_mask"]),
+        path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "logits": {0: "batch", 1: "sequence"},
+        },
+        opset_version=opset,
+    )
+    # The ONNX backend loads the tokenizer and labels from the same directory.
+    model.config.save_pretrained(output_dir)
+    comma_fixer.tokenizer.save_pretrained(output_dir)
+    return path
+
+
+def check_parity(torch_fixer: CommaFixer, onnx_fixer: CommaFixer, samples: list[str]) -> float:
+    batch = torch_fixer.tokenizer(samples, padding=True, return_tensors="np")
+    with torch.inference_mode():
+        expected = torch_fixer.model(torch.from_numpy(batch["input_ids"]), torch.from_numpy(batch["attention_mask"]))
+    expected = expected.logits.numpy()
+    actual = onnx_fixer.model.run(
+        ["logits"], {"input_ids": batch["input_ids"], "attention_mask": batch["attention_mask"]}
+    )
+    actual = actual[0]
+    mask = batch["attention_mask"].astype(bool)
+    if not np.array_equal(expected.argmax(-1)[mask], actual.argmax(-1)[mask]):
+        raise RuntimeError("ONNX predictions differ from the torch model.")
+    if torch_fixer.fix_commas_batch(samples) != onnx_fixer.fix_commas_batch(samples):
+        raise RuntimeError("ONNX output texts differ from the torch model.")
+    return float(np.abs(expected - actual)[mask].max())
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    comma_fixer = CommaFixer(args.model, "cpu")
+    path = export_onnx(comma_fixer, args.output, args.opset)
+    onnx_fixer = CommaFixer(args.output, "cpu", backend="onnx")
+    max_diff = check_parity(comma_fixer, onnx_fixer, parity_samples)
+    print(f"Exported {path}, max logit difference to torch: {max_diff:.2e}")
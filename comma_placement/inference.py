@@ -1,6 +1,9 @@
 import argparse
+import sys
 
-from comma_fixer import CommaFixer
+from .bulk import run_bulk
+from .comma_fixer import CommaFixer
+from .pool import CommaFixerPool
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -10,15 +13,83 @@ parser.add_argument(
     help="Please provide a model-id on HF or local path.",
 )
 parser.add_argument("--input", type=str, default="One two three.", help="Enter text without commas.")
+parser.add_argument("--input_file", type=str, default=None, help="Text or JSONL file to process, '-' for stdin.")
+parser.add_argument("--output_file", type=str, default="-", help="Where to write the results, '-' for stdout.")
+parser.add_argument("--format", choices=["text", "jsonl"], default="text", help="One document per line or JSONL.")
+parser.add_argument("--text_field", type=str, default="text", help="JSONL field with the input text.")
+parser.add_argument("--output_field", type=str, default="text_with_commas", help="JSONL field for the result.")
+parser.add_argument("--max_docs", type=int, default=64, help="Max number of documents read per batch.")
+parser.add_argument("--max_chars", type=int, default=65536, help="Max number of characters read per batch.")
+parser.add_argument("--report_every", type=float, default=10.0, help="Seconds between progress reports.")
+parser.add_argument("--workers", type=int, default=1, help="Worker processes for --input_file, 0 uses all cores.")
+parser.add_argument("--threads_per_worker", type=int, default=None, help="Torch threads of each worker process.")
 parser.add_argument("--device", default="cpu")
-args = parser.parse_args()
-
-peft_model_id = args.model
-device = args.device
+parser.add_argument("--batch_size", type=int, default=16, help="Max number of chunks in one forward pass.")
+parser.add_argument("--max_tokens", type=int, default=None, help="Max number of padded tokens in one forward pass.")
+parser.add_argument(
+    "--chunking",
+    choices=["sentence", "window"],
+    default="sentence",
+    help="Split long texts by sentences with spaCy or by overlapping token windows.",
+)
+parser.add_argument("--backend", choices=["torch", "onnx"], default="torch", help="ONNX needs an exported model path.")
+parser.add_argument("--intra_op_threads", type=int, default=None, help="Threads used inside one ONNX operator.")
+parser.add_argument("--inter_op_threads", type=int, default=None, help="Threads used across ONNX operators.")
+parser.add_argument("--quantize", action="store_true", help="Run an int8 dynamically quantized model on cpu.")
+parser.add_argument("--quantized_path", type=str, default=None, help="Where to cache the quantized weights.")
+parser.add_argument("--cache_dir", type=str, default=None, help="Directory for the merged model, reused offline.")
+parser.add_argument("--revision", type=str, default=None, help="Revision of the adapter on HF.")
+parser.add_argument("--fast", action="store_true", help="SDPA attention, bf16 autocast and torch.compile.")
+parser.add_argument("--no_bf16", action="store_true", help="Keep fp32 in the fast path, also on bf16 hardware.")
 
+parser.add_argument("--cache_size", type=int, default=0, help="Max number of cached chunk results, 0 disables it.")
+parser.add_argument("--cache_max_chars", type=int, default=None, help="Max number of characters held by the cache.")
 
 if __name__ == "__main__":
+    args = parser.parse_args()
+    peft_model_id = args.model
+    device = args.device
     sample_sentence = args.input
-    comma_fixer = CommaFixer(peft_model_id, device)
-    res = comma_fixer.fix_commas(sample_sentence)
-    print(f"Formatted string with commas:\n {res}")
+    fixer_kwargs = dict(
+        batch_size=args.batch_size,
+        max_tokens=args.max_tokens,
+        chunking=args.chunking,
+        backend=args.backend,
+        intra_op_threads=args.intra_op_threads,
+        inter_op_threads=args.inter_op_threads,
+        quantize=args.quantize,
+        quantized_path=args.quantized_path,
+        cache_dir=args.cache_dir,
+        revision=args.revision,
+        cache_size=args.cache_size,
+        cache_max_chars=args.cache_max_chars,
+        fast=args.fast,
+        bf16=False if args.no_bf16 else None,
+    )
+    if args.input_file is not None and args.workers != 1:
+        comma_fixer = CommaFixerPool(
+            peft_model_id, device, args.workers or None, args.threads_per_worker, **fixer_kwargs
+        )
+    else:
+        comma_fixer = CommaFixer(peft_model_id, device, **fixer_kwargs)
+
+    if args.input_file is None:
+        res = comma_fixer.fix_commas(sample_sentence)
+        print(f"Formatted string with commas:\n {res}")
+    else:
+        input_stream = sys.stdin if args.input_file == "-" else open(args.input_file, encoding="utf-8")
+        output_stream = sys.stdout if args.output_file == "-" else open(args.output_file, "w", encoding="utf-8")
+        with input_stream, output_stream:
+            run_bulk(
+                comma_fixer,
+                input_stream,
+                output_stream,
+                args.format,
+                args.text_field,
+                args.output_field,
+                args.max_docs,
+                args.max_chars,
+                args.report_every,
+            )
+        if isinstance(comma_fixer, CommaFixerPool):
+            comma_fixer.close()
@@ -1,28 +1,79 @@
-import evaluate
 import numpy as np
-import seqeval
-from config import LABEL_LIST
 
-seqeval = evaluate.load("seqeval")
+try:
+    from .config import LABEL2ID
+except ImportError:
+    # train.py and distill.py run as scripts from this directory, evaluation.py as a module of the package.
+    from config import LABEL2ID
 
+COMMA_ID = LABEL2ID["B-COMMA"]
 
-def compute_metrics(p):
-    predictions, labels = p
-    predictions = np.argmax(predictions, axis=2)
-
-    true_predictions = [
-        [LABEL_LIST[p] for (p, l) in zip(prediction, label) if l != -100]
-        for prediction, label in zip(predictions, labels)
-    ]
-    true_labels = [
-        [LABEL_LIST[l] for (p, l) in zip(prediction, label) if l != -100]
-        for prediction, label in zip(predictions, labels)
-    ]
-
-    results = seqeval.compute(predictions=true_predictions, references=true_labels)
+
+def _to_numpy(array) -> np.ndarray:
+    # Batched evaluation passes torch tensors, possibly still on the device.
+    if hasattr(array, "cpu"):
+        array = array.cpu()
+    return np.asarray(array)
+
+
+def preprocess_logits_for_metrics(logits, labels):
+    # Only the predicted labels are kept between eval steps, not the whole logits.
+    if isinstance(logits, tuple):
+        logits = logits[0]
+    return logits.argmax(dim=-1)
+
+
+def count_statistics(predictions, labels) -> np.ndarray:
+    # Every B-COMMA is a one-token entity for seqeval, so entity matches are token matches.
+    # Returns true positives, predicted and true commas, correct and all labeled tokens.
+    predictions, labels = _to_numpy(predictions), _to_numpy(labels)
+    if predictions.ndim == labels.ndim + 1:
+        predictions = np.argmax(predictions, axis=-1)
+    mask = labels != -100
+    predictions, labels = predictions[mask], labels[mask]
+    predicted, true = predictions == COMMA_ID, labels == COMMA_ID
+    return np.array(
+        [
+            np.sum(predicted & true),
+            np.sum(predicted),
+            np.sum(true),
+            np.sum(predictions == labels),
+            labels.size,
+        ],
+        dtype=np.int64,
+    )
+
+
+def metrics_from_statistics(statistics: np.ndarray) -> dict:
+    tp, num_predicted, num_true, num_correct, num_tokens = (int(value) for value in statistics)
+    # Same formulas and zero division handling as seqeval's micro average.
+    precision = tp / num_predicted if num_predicted else 0.0
+    recall = tp / num_true if num_true else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
     return {
-        "precision": results["overall_precision"],
-        "recall": results["overall_recall"],
-        "f1": results["overall_f1"],
-        "accuracy": results["overall_accuracy"],
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "accuracy": num_correct / num_tokens if num_tokens else 0.0,
     }
+
+
+def compute_metrics(p):
+    predictions, labels = p
+    return metrics_from_statistics(count_statistics(predictions, labels))
+
+
+class StreamingMetrics:
+    """compute_metrics for `batch_eval_metrics`, it sums counts over eval batches instead of holding all predictions."""
+
+    def __init__(self) -> None:
+        self.statistics = np.zeros(5, dtype=np.int64)
+
+    def __call__(self, p, compute_result: bool = True) -> dict:
+        predictions, labels = p
+        self.statistics += count_statistics(predictions, labels)
+        if not compute_result:
+            return {}
+        metrics = metrics_from_statistics(self.statistics)
+        self.statistics = np.zeros(5, dtype=np.int64)
+        return metrics
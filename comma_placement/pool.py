@@ -0,0 +1,86 @@
+# Process pool for offline bulk inference, every worker runs its own CommaFixer with a fixed number of threads.
+import multiprocessing as mp
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+import torch
+
+from .comma_fixer import CommaFixer
+
+_comma_fixer = None
+_executor = None
+
+
+def _init_worker(config_path: str, device: str, num_threads: int, fixer_kwargs: dict):
+    global _comma_fixer, _executor
+    torch.set_num_threads(num_threads)
+    # OpenMP threads of the parent do not survive the fork, but the main thread still holds their pool
+    # and its first parallel op would wait for them forever. A thread started here gets a pool of its own.
+    _executor = ThreadPoolExecutor(1, initializer=torch.set_num_threads, initargs=(num_threads,))
+    # A forked worker already holds the parent's model and shares its weights copy-on-write.
+    if _comma_fixer is None:
+        _comma_fixer = CommaFixer(config_path, device, **fixer_kwargs)
+
+
+def _fix_commas_batch(texts: list[str]) -> list[str]:
+    return _executor.submit(_comma_fixer.fix_commas_batch, texts).result()
+
+
+class CommaFixerPool:
+    def __init__(
+        self,
+        config_path: str,
+        device: str = "cpu",
+        num_workers: Optional[int] = None,
+        threads_per_worker: Optional[int] = None,
+        task_size: int = 32,
+        **fixer_kwargs,
+    ) -> None:
+        global _comma_fixer
+        self.num_workers = num_workers or os.cpu_count()
+        self.threads_per_worker = threads_per_worker or max(1, os.cpu_count() // self.num_workers)
+        self.task_size = task_size
+        # Keep a few tasks per worker in flight, so workers never wait while memory stays bounded.
+        self.max_pending = 2 * self.num_workers
+
+        # Workers get their parallelism from the pool, not from the Rust tokenizer threads.
+        os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+        if "fork" in mp.get_all_start_methods():
+            # Load the model once before forking, workers then share its memory pages.
+            _comma_fixer = CommaFixer(config_path, device, **fixer_kwargs)
+            context = mp.get_context("fork")
+        else:
+            context = mp.get_context("spawn")
+        try:
+            self.pool = context.Pool(
+                self.num_workers,
+                initializer=_init_worker,
+                initargs=(config_path, device, self.threads_per_worker, fixer_kwargs),
+            )
+        finally:
+            _comma_fixer = None
+
+    def imap_batches(self, batches: Iterable[list[str]]) -> Iterator[list[str]]:
+        pending = deque()
+        for texts in batches:
+            pending.append(self.pool.apply_async(_fix_commas_batch, (texts,)))
+            if len(pending) >= self.max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def fix_commas_batch(self, texts: list[str]) -> list[str]:
+        tasks = (texts[start : start + self.task_size] for start in range(0, len(texts), self.task_size))
+        return [fixed for batch in self.imap_batches(tasks) for fixed in batch]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
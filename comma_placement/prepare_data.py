@@ -1,79 +1,82 @@
+import argparse
+import glob
 import json
+import os
+from typing import Iterator
 
 import spacy
-from config import DATASET_NAME, DATASET_PATH, PROCESSED_DATA, RAW_DATA
-from datasets import load_dataset, load_from_disk
-from sklearn.model_selection import train_test_split
+from config import DATASET_NAME, DATASET_PATH, PROCESSED_DATA
+from datasets import load_dataset
 from utils import data_process
 
-# Let's first load some raw text data from hugginface
-nlp = spacy.load("en_core_web_sm")
-dataset = load_dataset("wikitext", "wikitext-103-v1")
-
-
-def sentence_to_sample(sentence: str) -> str:
-    sentence = sentence.strip()
-    words = [word.text for word in nlp(sentence)]
-    tags = []
-    clean_words = []
-    for i in range(len(words) - 1):
-        if words[i] == ",":
-            continue
-        if words[i + 1] == ",":
-            clean_words.append(words[i])
-            tags.append(1)
-        else:
-            clean_words.append(words[i])
-            tags.append(0)
-    clean_words.append(words[-1])
-    tags.append(0)
-    assert len(tags) == len(clean_words)
-    return json.dumps({"tokens": clean_words, "tags": tags})
-
-
-dataset_train = dataset["train"][0:100000]["text"]
-samples_train = data_process.preprocess_texts(dataset_train)
-txt_path = f"{RAW_DATA}/raw_wiki_lines.txt"
-data_process.save_to_file(samples_train, txt_path)
-
-with open(txt_path) as f:
-    data = f.readlines()
-
-formatted_samples = []
-
-for i in data:
-    sentences = i.split(".")
-    for j in sentences:
-        sentence = j.strip()
-        if len(sentence.split()) < 10:
-            continue
-        formatted_samples.append(sentence_to_sample(j + "."))
-json_path = f"{RAW_DATA}/wiki_data.json"
-data_process.save_to_file(formatted_samples, json_path)
-
-
-with open(json_path) as f:
-    data = f.readlines()
-
-train_lines, test_lines = train_test_split(data, test_size=0.16, random_state=42)
-train_lines, val_lines = train_test_split(train_lines, test_size=0.2, random_state=42)
-
-processed_paths = [f"{PROCESSED_DATA}/wiki_data_{step}.json" for step in ["train, validation, test"]]
-
-for step, lines in zip(processed_paths, [train_lines, val_lines, test_lines]):
-    with open(f"{step}", "w") as f:
-        f.writelines(lines)
-
-
-dataset_structure = {
-    "train": processed_paths[0],
-    "validation": processed_paths[1],
-    "test": processed_paths[2],
-}
-
-processed_dataset = load_dataset("json", data_files=dataset_structure)
-processed_dataset.save_to_disk(DATASET_PATH)
-
-# Upload to hub if needed.
-dd = load_from_disk(DATASET_PATH)
-dd.push_to_hub(DATASET_NAME)
+SPLITS = ["train", "validation", "test"]
+
+parser = argparse.ArgumentParser(prog="Build the comma placement dataset from wikitext.")
+parser.add_argument("--max_lines", type=int, default=None, help="Only use the first lines of wikitext, all by default.")
+parser.add_argument("--read_batch_size", type=int, default=10_000, help="Wikitext lines cleaned at once.")
+parser.add_argument("--n_process", type=int, default=os.cpu_count(), help="spaCy tokenizer processes.")
+parser.add_argument("--batch_size", type=int, default=1000, help="Sentences sent to a spaCy process at once.")
+parser.add_argument("--shard_size", type=int, default=100_000, help="Max number of samples per output shard.")
+parser.add_argument("--output_dir", type=str, default=f"{PROCESSED_DATA}/wiki_data")
+parser.add_argument("--push_to_hub", action="store_true", help=f"Upload the dataset to HF as {DATASET_NAME}.")
+
+
+class ShardWriter:
+    # Samples go straight to JSONL shards of every subset, a new shard is opened every `shard_size` samples.
+    def __init__(self, output_dir: str, shard_size: int) -> None:
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.files = {}
+        self.counts = {split: 0 for split in SPLITS}
+        os.makedirs(output_dir, exist_ok=True)
+        # Shards of an earlier, larger run would otherwise end up in the dataset.
+        for path in glob.glob(f"{output_dir}/*.jsonl"):
+            os.remove(path)
+
+    def write(self, split: str, sample: dict):
+        if self.counts[split] % self.shard_size == 0:
+            if split in self.files:
+                self.files[split].close()
+            shard = self.counts[split] // self.shard_size
+            self.files[split] = open(f"{self.output_dir}/{split}-{shard:05d}.jsonl", "w")
+        self.files[split].write(json.dumps(sample) + "\n")
+        self.counts[split] += 1
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def read_sentences(dataset, batch_size: int) -> Iterator[str]:
+    # Lines are read from the memory mapped Arrow file batch by batch, the corpus is never held in memory.
+    for batch in dataset.iter(batch_size=batch_size):
+        samples = data_process.preprocess_texts(batch["text"])
+        yield from data_process.split_into_sentences(samples)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    # Only tokens are needed, so a blank pipeline with just the English tokenizer is enough.
+    nlp = spacy.blank("en")
+    dataset = load_dataset("wikitext", "wikitext-103-v1", split="train")
+    if args.max_lines is not None:
+        dataset = dataset.select(range(min(args.max_lines, len(dataset))))
+
+    writer = ShardWriter(args.output_dir, args.shard_size)
+    try:
+        docs = nlp.pipe(
+            read_sentences(dataset, args.read_batch_size), batch_size=args.batch_size, n_process=args.n_process
+        )
+        for doc in docs:
+            sample = data_process.words_to_sample([token.text for token in doc])
+            writer.write(data_process.assign_split(doc.text), sample)
+    finally:
+        writer.close()
+    print(f"Samples per subset: {writer.counts}")
+
+    data_files = {split: f"{args.output_dir}/{split}-*.jsonl" for split in SPLITS if writer.counts[split]}
+    processed_dataset = load_dataset("json", data_files=data_files)
+    processed_dataset.save_to_disk(DATASET_PATH)
+
+    if args.push_to_hub:
+        processed_dataset.push_to_hub(DATASET_NAME)
@@ -0,0 +1,23 @@
+from comma_placement.utils.batching import TokenBudgetBatchSampler, make_token_budget_batches, padding_efficiency
+
+
+def test_make_token_budget_batches():
+    lengths = [10, 3, 5, 2, 40]
+    batches = make_token_budget_batches(lengths, max_tokens=12)
+    assert batches == [[3, 1], [2], [0], [4]]
+    assert all(len(batch) * max(lengths[i] for i in batch) <= 12 for batch in batches[:-1])
+
+
+def test_padding_efficiency():
+    assert padding_efficiency([2, 4], [[0, 1]]) == 0.75
+    assert padding_efficiency([2, 4], [[0], [1]]) == 1.0
+
+
+def test_token_budget_sampler_shuffles_every_epoch():
+    lengths = [i % 50 + 1 for i in range(1000)]
+    sampler = TokenBudgetBatchSampler(lengths, max_tokens=256, seed=0)
+    first, second = list(sampler), list(sampler)
+    assert len(first) == len(second) == len(sampler)
+    assert first != second
+    assert sorted(i for batch in first for i in batch) == list(range(1000))
+    assert all(len(batch) * max(lengths[i] for i in batch) <= 256 for batch in first)
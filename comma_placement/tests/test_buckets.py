@@ -0,0 +1,14 @@
+from comma_placement.comma_fixer import _bucket, _buckets
+
+
+def test_bucket_rounds_up_to_power_of_two():
+    assert [_bucket(size, 16, 512) for size in [1, 16, 17, 100, 300, 512]] == [16, 16, 32, 128, 512, 512]
+
+
+def test_bucket_is_capped_at_largest():
+    assert [_bucket(size, 1, 12) for size in [3, 9, 12, 13, 20]] == [4, 12, 12, 16, 32]
+
+
+def test_buckets():
+    assert _buckets(16, 512) == [16, 32, 64, 128, 256, 512]
+    assert _buckets(1, 12) == [1, 2, 4, 8, 12]
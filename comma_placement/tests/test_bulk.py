@@ -0,0 +1,50 @@
+import io
+import json
+
+from comma_placement import bulk
+
+
+class UpperFixer:
+    def __init__(self):
+        self.calls = []
+
+    def fix_commas_batch(self, texts):
+        self.calls.append(len(texts))
+        return [text.upper() for text in texts]
+
+
+def test_text_format_keeps_order_and_empty_lines():
+    fixer = UpperFixer()
+    output = io.StringIO()
+    stats = bulk.run_bulk(fixer, io.StringIO("one\n\ntwo\nthree\n"), output, max_docs=2, report_every=0)
+    assert output.getvalue() == "ONE\n\nTWO\nTHREE\n"
+    assert fixer.calls == [2, 2]
+    assert stats["docs"] == 4
+
+
+def test_jsonl_format_keeps_fields():
+    lines = "\n".join(json.dumps({"id": i, "text": text}) for i, text in enumerate(["a b", "c d"]))
+    output = io.StringIO()
+    bulk.run_bulk(UpperFixer(), io.StringIO(lines), output, input_format="jsonl", report_every=0)
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert records == [
+        {"id": 0, "text": "a b", "text_with_commas": "A B"},
+        {"id": 1, "text": "c d", "text_with_commas": "C D"},
+    ]
+
+
+def test_batches_are_bounded_by_chars():
+    records = [(None, "a" * 10)] * 5
+    assert [len(batch) for batch in bulk.batch_records(records, max_docs=10, max_chars=25)] == [2, 2, 1]
+
+
+class PoolLikeFixer(UpperFixer):
+    def imap_batches(self, batches):
+        for texts in batches:
+            yield self.fix_commas_batch(texts)
+
+
+def test_pool_results_are_matched_with_their_batches():
+    output = io.StringIO()
+    bulk.run_bulk(PoolLikeFixer(), io.StringIO("a\nb\nc\n"), output, max_docs=2, report_every=0)
+    assert output.getvalue() == "A\nB\nC\n"
@@ -0,0 +1,31 @@
+from comma_placement import e2e_evaluation
+
+
+class StripFixer:
+    def fix_commas_batch(self, texts):
+        return [text.replace(",", "") for text in texts]
+
+
+def test_tokens_to_text_puts_commas_back():
+    text = e2e_evaluation.tokens_to_text(["However", "it", "works", "."], [1, 0, 0, 0])
+    assert text == "However, it works."
+
+
+def test_comma_positions_ignore_spacing():
+    assert e2e_evaluation.comma_positions("a, b c,d") == e2e_evaluation.comma_positions("a ,b  c, d") == {1, 3}
+
+
+def test_score():
+    report = e2e_evaluation.score(["a, b, c d.", "e f, g."], ["a, b c, d.", "e f, g."])
+    assert report["precision"] == 2 / 3
+    assert report["recall"] == 2 / 3
+    assert report["altered_docs"] == 0
+    assert e2e_evaluation.score(["a, b."], ["a, c."])["altered_docs"] == 1
+
+
+def test_evaluate_e2e_without_commas():
+    report = e2e_evaluation.evaluate_e2e(StripFixer(), ["a, b.", "c d.", "e, f."], docs_per_batch=2)
+    assert report["docs"] == 3
+    assert report["recall"] == 0.0
+    assert report["f1"] == 0.0
+    assert report["docs_per_sec"] > 0
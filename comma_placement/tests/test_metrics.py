@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from comma_placement.metrics import StreamingMetrics
+
+# Two eval batches, -100 marks special tokens and continuation subwords.
+BATCHES = [
+    (np.array([[0, 1, 1, 0, 0], [1, 0, 0, 0, 0]]), np.array([[-100, 1, 0, 0, -100], [-100, 1, 0, 1, -100]])),
+    (np.array([[0, 0, 1, 1, 0]]), np.array([[-100, 0, 1, 1, 1]])),
+]
+# Scores of seqeval on the same predictions and labels.
+SEQEVAL = {"precision": 0.75, "recall": 0.5, "f1": 0.6, "accuracy": 0.6}
+
+
+def test_matches_seqeval():
+    predictions = np.concatenate([predictions for predictions, _ in BATCHES])
+    labels = np.concatenate([labels for _, labels in BATCHES])
+    assert StreamingMetrics()((predictions, labels)) == pytest.approx(SEQEVAL)
+
+
+def test_batches_accumulate_to_one_shot_result():
+    metrics = StreamingMetrics()
+    assert metrics(BATCHES[0], compute_result=False) == {}
+    assert metrics(BATCHES[1], compute_result=True) == pytest.approx(SEQEVAL)
+    # Counts are reset after a result, the next evaluation starts from scratch.
+    assert metrics(BATCHES[1]) == pytest.approx(StreamingMetrics()(BATCHES[1]))
+
+
+def test_no_predicted_commas():
+    predictions, labels = np.array([[0, 0, 0, 0]]), np.array([[-100, 1, 0, 1]])
+    result = StreamingMetrics()((predictions, labels))
+    assert result == pytest.approx({"precision": 0.0, "recall": 0.0, "f1": 0.0, "accuracy": 1 / 3})
+
+
+def test_logits_are_reduced_with_argmax():
+    predictions, labels = BATCHES[1]
+    logits = np.eye(2)[predictions]
+    assert StreamingMetrics()((logits, labels)) == pytest.approx(StreamingMetrics()((predictions, labels)))
@@ -1,5 +1,5 @@
 import pytest
-from comma_placement.comma_fixer import CommaFixer
+from comma_placement.comma_fixer import ChunkCache, CommaFixer
 
 
 @pytest.fixture()
@@ -40,3 +40,76 @@ def test_fix_wrong(model):
 def test_remove_commas(model):
     sample = "One, two, three."
     assert model.remove_commas(sample) == "One two three."
+
+
+def test_batch_size_invariance(model):
+    sample = """You have probably also heard a lot of tips on using commas in addition to these rules: “Use one wherever you would naturally use a pause” or “Read your work aloud, and whenever you feel yourself pausing, put in a comma.” These techniques help to a degree, but our ears tend to trick us and we need other avenues of attack."""
+    sample = " ".join([sample] * 3)
+    predicted = model.fix_commas(sample)
+    model.batch_size = 1
+    assert model.fix_commas(sample) == predicted
+
+
+def test_fix_commas_batch(model):
+    samples = ["One two three.", "There are no commas here.", "However there is a comma here.", "I, am a man."]
+    expected = [model.fix_commas(sample) for sample in samples]
+    assert model.fix_commas_batch(samples, batch_size=3, max_tokens=32) == expected
+    assert model.fix_commas_batch([]) == []
+
+
+def test_window_chunking(model):
+    sample = "However, there is a comma here."
+    expected = model.fix_commas(sample)
+    model.chunking = "window"
+    model.window_size, model.window_overlap = 16, 4
+    assert model.fix_commas(sample * 20).replace(",", "") == model.remove_commas(sample * 20)
+    model.window_size = 512
+    assert model.fix_commas(sample) == expected
+
+
+def test_onnx_backend(model, tmp_path):
+    pytest.importorskip("onnxruntime")
+    from comma_placement.export_onnx import export_onnx
+
+    export_onnx(model, str(tmp_path))
+    onnx_model = CommaFixer(str(tmp_path), "cpu", backend="onnx")
+    samples = ["One two three.", "Coffee an apple a milk.", "However there is a comma here."]
+    assert onnx_model.fix_commas_batch(samples) == model.fix_commas_batch(samples)
+
+
+def test_quantized_cache(tmp_path):
+    path = str(tmp_path / "quantized.pt")
+    quantized = CommaFixer(
+        "just097/roberta-base-lora-comma-placement-r-16-alpha-32", "cpu", quantize=True, quantized_path=path
+    )
+    cached = CommaFixer(
+        "just097/roberta-base-lora-comma-placement-r-16-alpha-32", "cpu", quantize=True, quantized_path=path
+    )
+    samples = ["One two three.", "However there is a comma here."]
+    assert cached.fix_commas_batch(samples) == quantized.fix_commas_batch(samples)
+
+
+def test_merged_model_cache(model, tmp_path):
+    cached = CommaFixer("just097/roberta-base-lora-comma-placement-r-16-alpha-32", "cpu", cache_dir=str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+    reloaded = CommaFixer("just097/roberta-base-lora-comma-placement-r-16-alpha-32", "cpu", cache_dir=str(tmp_path))
+    samples = ["One two three.", "However there is a comma here."]
+    assert cached.fix_commas_batch(samples) == reloaded.fix_commas_batch(samples) == model.fix_commas_batch(samples)
+
+
+def test_chunk_cache(model):
+    samples = ["One two three.", "However there is a comma here.", "One two three."]
+    expected = model.fix_commas_batch(samples)
+    model.cache = ChunkCache(max_entries=1)
+    assert model.fix_commas_batch(samples) == expected
+    assert model.fix_commas_batch(samples[1:2]) == expected[1:2]
+    stats = model.cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"], stats["evictions"]) == (1, 1, 2, 1)
+
+
+def test_pool_matches_single_process(model):
+    from comma_placement.pool import CommaFixerPool
+
+    samples = ["One two three.", "There are no commas here.", "However there is a comma here.", "I, am a man."]
+    with CommaFixerPool("just097/roberta-base-lora-comma-placement-r-16-alpha-32", num_workers=2, task_size=1) as pool:
+        assert pool.fix_commas_batch(samples) == model.fix_commas_batch(samples)
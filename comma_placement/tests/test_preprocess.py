@@ -24,3 +24,29 @@ def test_remove_short():
 def test_remove_titles():
     samples = ["One == Two", "Normal string."]
     assert data_process.remove_titles(samples) == ["Normal string."]
+
+
+def test_split_into_sentences():
+    samples = ["One two three four five six seven eight nine ten. Too short. Eleven"]
+    assert data_process.split_into_sentences(samples) == ["One two three four five six seven eight nine ten."]
+
+
+def test_words_to_sample():
+    words = ["One", ",", "two", ",", "three", "."]
+    assert data_process.words_to_sample(words) == {"tokens": ["One", "two", "three", "."], "tags": [1, 1, 0, 0]}
+
+
+def test_assign_split():
+    splits = [data_process.assign_split(f"Sentence number {i}.") for i in range(10_000)]
+    assert splits == [data_process.assign_split(f"Sentence number {i}.") for i in range(10_000)]
+    assert abs(splits.count("test") / len(splits) - 0.16) < 0.02
+    assert abs(splits.count("validation") / len(splits) - 0.168) < 0.02
+
+
+def test_align_labels():
+    word_ids = [[None, 0, 0, 1, None], [None, 0, 1, 1, 2, None]]
+    tags = [[1, 0], [0, 1, 1]]
+    assert data_process.align_labels(word_ids, tags) == [
+        [-100, 1, -100, 0, -100],
+        [-100, 0, 1, -100, 1, -100],
+    ]
@@ -0,0 +1,9 @@
+import subprocess
+import sys
+
+
+def test_import_is_lazy():
+    # A fresh interpreter, so modules imported by other tests do not count.
+    code = "import sys, comma_placement.comma_fixer; print(' '.join(m for m in ('spacy', 'peft') if m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    assert output.strip() == ""
@@ -0,0 +1,127 @@
+# Token-budget batching and padding statistics for the Trainer.
+from typing import Iterator, Optional
+
+import numpy as np
+from torch.utils.data import DataLoader
+from transformers import Trainer
+from transformers.trainer_pt_utils import LengthGroupedSampler
+
+
+def make_token_budget_batches(lengths: list[int], max_tokens: int, order: Optional[np.ndarray] = None) -> list[list]:
+    # Lengths are packed in ascending order, so the padded size of a batch is set by the item being added.
+    # An item longer than the budget gets a batch of its own.
+    if order is None:
+        order = np.argsort(lengths, kind="stable")
+    batches, current = [], []
+    for i in order:
+        i = int(i)
+        if current and (len(current) + 1) * lengths[i] > max_tokens:
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+class TokenBudgetBatchSampler:
+    """Yields batches of indices whose padded size stays within `max_tokens`."""
+
+    def __init__(self, lengths: list[int], max_tokens: int, shuffle: bool = True, seed: int = 0) -> None:
+        self.lengths = np.asarray(lengths)
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        # Items are always packed by sorted length, so the number of batches is the same every epoch.
+        self.num_batches = len(make_token_budget_batches(self.lengths, max_tokens))
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        return self.num_batches
+
+    def __iter__(self) -> Iterator[list]:
+        if not self.shuffle:
+            yield from make_token_budget_batches(self.lengths, self.max_tokens)
+            return
+        rng = np.random.default_rng(self.seed + self.epoch)
+        # A random tie-break mixes items of equal length across batches, then the batch order is shuffled.
+        order = np.lexsort((rng.random(len(self.lengths)), self.lengths))
+        batches = make_token_budget_batches(self.lengths, self.max_tokens, order)
+        self.epoch += 1
+        for i in rng.permutation(len(batches)):
+            yield batches[i]
+
+
+def padding_efficiency(lengths: list[int], batches: list[list]) -> float:
+    # Share of real tokens among all tokens of the padded batches.
+    real = sum(lengths[i] for batch in batches for i in batch)
+    padded = sum(len(batch) * max(lengths[i] for i in batch) for batch in batches if len(batch))
+    return real / max(padded, 1)
+
+
+class LengthBatchingTrainer(Trainer):
+    """Trainer that can batch by a token budget instead of a number of samples.
+
+    With `max_tokens_per_batch` set, every dataloader packs samples of similar length into batches of at most that
+    many padded tokens. Evaluation batches are sorted by length, so predictions come back in that order.
+    """
+
+    def __init__(self, *args, max_tokens_per_batch: Optional[int] = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.max_tokens_per_batch = max_tokens_per_batch
+
+    def __lengths(self, dataset) -> list[int]:
+        if self.args.length_column_name in dataset.column_names:
+            return dataset[self.args.length_column_name]
+        return [len(input_ids) for input_ids in dataset["input_ids"]]
+
+    def __token_budget_dataloader(self, dataset, shuffle: bool, description: str) -> DataLoader:
+        sampler = TokenBudgetBatchSampler(
+            self.__lengths(dataset), self.max_tokens_per_batch, shuffle=shuffle, seed=self.args.seed
+        )
+        dataloader = DataLoader(
+            self._remove_unused_columns(dataset, description=description),
+            batch_sampler=sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(dataloader)
+
+    def get_train_dataloader(self) -> DataLoader:
+        if self.max_tokens_per_batch is None:
+            return super().get_train_dataloader()
+        return self.__token_budget_dataloader(self.train_dataset, shuffle=True, description="training")
+
+    def get_eval_dataloader(self, eval_dataset=None) -> DataLoader:
+        if self.max_tokens_per_batch is None:
+            return super().get_eval_dataloader(eval_dataset)
+        dataset = eval_dataset if eval_dataset is not None else self.eval_dataset
+        return self.__token_budget_dataloader(dataset, shuffle=False, description="evaluation")
+
+    def get_test_dataloader(self, test_dataset) -> DataLoader:
+        if self.max_tokens_per_batch is None:
+            return super().get_test_dataloader(test_dataset)
+        return self.__token_budget_dataloader(test_dataset, shuffle=False, description="test")
+
+    def padding_report(self, dataset, train: bool = True) -> dict:
+        # Padding efficiency of the configured batching against plain random or sequential batches.
+        lengths = self.__lengths(dataset)
+        batch_size = self.args.per_device_train_batch_size if train else self.args.per_device_eval_batch_size
+        order = np.random.default_rng(self.args.seed).permutation(len(lengths)) if train else np.arange(len(lengths))
+        default_batches = [order[start : start + batch_size] for start in range(0, len(order), batch_size)]
+        if self.max_tokens_per_batch is not None:
+            batches = list(TokenBudgetBatchSampler(lengths, self.max_tokens_per_batch, shuffle=train))
+        elif train and self.args.group_by_length:
+            grouped = list(LengthGroupedSampler(batch_size, lengths=lengths))
+            batches = [grouped[start : start + batch_size] for start in range(0, len(grouped), batch_size)]
+        else:
+            batches = default_batches
+        return {
+            "batches": len(batches),
+            "padding_efficiency": padding_efficiency(lengths, batches),
+            "default_padding_efficiency": padding_efficiency(lengths, default_batches),
+        }
@@ -1,8 +1,15 @@
+import hashlib
+import json
+import os
 import re
+from typing import Optional
+
+import numpy as np
 
 space_remover = r"\s([,?.!:;](?:\s|$))"
 quote_space_remover = r'"\s*([^"]*?)\s*"'
-tokenizer = None
+# Bump it whenever tokenization or label alignment changes, to invalidate the tokenized dataset cache.
+PREPROCESSING_VERSION = 2
 
 
 def remove_spaces(samples):
@@ -42,28 +49,99 @@ def preprocess_texts(samples: list) -> list:
     return samples
 
 
+def split_into_sentences(samples: list, min_words: int = 10) -> list:
+    sentences = [sentence.strip() for sample in samples for sentence in sample.split(".")]
+    return [sentence + "." for sentence in sentences if len(sentence.split()) >= min_words]
+
+
+def words_to_sample(words: list) -> dict:
+    # Commas are dropped from the tokens, the word before a comma is tagged with 1.
+    tags = []
+    clean_words = []
+    for i in range(len(words) - 1):
+        if words[i] == ",":
+            continue
+        clean_words.append(words[i])
+        tags.append(1 if words[i + 1] == "," else 0)
+    clean_words.append(words[-1])
+    tags.append(0)
+    return {"tokens": clean_words, "tags": tags}
+
+
+def assign_split(sentence: str, test_size: float = 0.16, validation_size: float = 0.2) -> str:
+    # A hash of the text decides the subset, so it does not depend on order, sharding or the number of processes.
+    digest = hashlib.blake2b(sentence.encode("utf-8"), digest_size=8).digest()
+    value = int.from_bytes(digest, "big") / 2**64
+    if value < test_size:
+        return "test"
+    if value < test_size + (1 - test_size) * validation_size:
+        return "validation"
+    return "train"
+
+
 def save_to_file(samples: list, path: str):
     with open(f"{path}", "w") as f:
         f.writelines([sample + "\n" for sample in samples])
 
 
-def tokenize_and_align_labels(examples):
-    tokenized_inputs = tokenizer(examples["tokens"], truncation=True, is_split_into_words=True)
+def align_labels(word_ids: list[list], tags: list[list]) -> list[list]:
+    # Only the first sub-token of every word gets the word's tag, special tokens and the rest get -100.
+    if not word_ids:
+        return []
+    lengths = np.array([len(ids) for ids in word_ids])
+    flat_ids = np.array([-1 if idx is None else idx for ids in word_ids for idx in ids], dtype=np.int64)
+    flat_tags = np.array([tag for example_tags in tags for tag in example_tags], dtype=np.int64)
+    example = np.repeat(np.arange(len(word_ids)), lengths)
+    tag_offsets = np.concatenate([[0], np.cumsum([len(example_tags) for example_tags in tags])[:-1]]).astype(np.int64)
+
+    starts_example = np.ones(len(flat_ids), dtype=bool)
+    starts_example[1:] = example[1:] != example[:-1]
+    previous_ids = np.concatenate([[-1], flat_ids[:-1]])
+    first_sub_token = (flat_ids != -1) & (starts_example | (flat_ids != previous_ids))
+
+    labels = np.full(len(flat_ids), -100, dtype=np.int64)
+    labels[first_sub_token] = flat_tags[tag_offsets[example[first_sub_token]] + flat_ids[first_sub_token]]
+    return [chunk.tolist() for chunk in np.split(labels, np.cumsum(lengths)[:-1])]
+
 
-    labels = []
-    for i, label in enumerate(examples[f"tags"]):
-        word_ids = tokenized_inputs.word_ids(batch_index=i)
-        previous_word_idx = None
-        label_ids = []
-        for word_idx in word_ids:
-            if word_idx is None:
-                label_ids.append(-100)
-            elif word_idx != previous_word_idx:
-                label_ids.append(label[word_idx])
-            else:
-                label_ids.append(-100)
-            previous_word_idx = word_idx
-        labels.append(label_ids)
-
-    tokenized_inputs["labels"] = labels
+def tokenize_and_align_labels(examples, tokenizer):
+    tokenized_inputs = tokenizer(examples["tokens"], truncation=True, is_split_into_words=True)
+    word_ids = [tokenized_inputs.word_ids(batch_index=i) for i in range(len(examples["tokens"]))]
+    tokenized_inputs["labels"] = align_labels(word_ids, examples["tags"])
+    # Lengths let the samplers group samples without reading the token ids.
+    tokenized_inputs["length"] = [len(input_ids) for input_ids in tokenized_inputs["input_ids"]]
     return tokenized_inputs
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    # The serialized fast tokenizer holds the vocab, merges and pre-tokenizer options like add_prefix_space.
+    if tokenizer.is_fast:
+        state = tokenizer.backend_tokenizer.to_str()
+    else:
+        state = json.dumps(sorted(tokenizer.get_vocab().items()))
+    return hashlib.sha256(f"{type(tokenizer).__name__}:{state}".encode("utf-8")).hexdigest()[:16]
+
+
+def load_tokenized_dataset(dataset_path: str, tokenizer, cache_dir: str, num_proc: Optional[int] = None):
+    # Tokenized subsets are saved once per dataset version and tokenizer, later runs memory map the Arrow files.
+    from datasets import load_dataset, load_from_disk
+
+    dataset = load_dataset(dataset_path)
+    dataset_version = ",".join(f"{split}={dataset[split]._fingerprint}" for split in sorted(dataset))
+    key = f"{PREPROCESSING_VERSION}:{dataset_version}:{tokenizer_fingerprint(tokenizer)}"
+    path = os.path.join(cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest()[:16])
+    if os.path.isdir(path):
+        return load_from_disk(path)
+
+    tokenized = dataset.map(
+        tokenize_and_align_labels,
+        batched=True,
+        fn_kwargs={"tokenizer": tokenizer},
+        remove_columns=dataset["train"].column_names,
+        num_proc=num_proc,
+    )
+    # Save into a temporary directory first, so an interrupted run never leaves a broken cache behind.
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    tokenized.save_to_disk(tmp_path)
+    os.replace(tmp_path, path)
+    return load_from_disk(path)
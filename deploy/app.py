@@ -1,33 +1,232 @@
 import argparse
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
 
 import uvicorn
 from comma_fixer import CommaFixer
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
 from logger import logger as base_loger
-from params import config_path
-from typings import FixedText, InputText
+from metrics import REQUESTS
+from params import (
+    MAX_BATCH_CHARS,
+    MAX_BATCH_TEXTS,
+    MAX_SESSION_CHARS,
+    MAX_SESSIONS,
+    MAX_TEXT_CHARS,
+    STREAM_MAX_IN_FLIGHT,
+    STREAM_SEGMENT_CHARS,
+    config_path,
+)
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest, multiprocess
+from scheduler import BatchScheduler
+from sessions import DocumentSession, SessionStore
+from streaming import BodyStreamingResponse, stream_fixed_segments
+from typings import BatchInput, BatchOutput, CacheStats, FixedText, InputText, SessionOutput, SessionText
+from workers import serve
 
 logger = base_loger.bind(corr_id="MAIN ")
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--port", type=int, default=80, help="Specify port to run the service.")
 parser.add_argument("--device", default="cpu")
-args = parser.parse_args()
+parser.add_argument("--model", default=config_path, help="Model-id on HF or local path.")
+parser.add_argument("--batch_size", type=int, default=16, help="Max number of chunks in one forward pass.")
+parser.add_argument(
+    "--chunking",
+    choices=["sentence", "window"],
+    default="sentence",
+    help="Split long texts by sentences with spaCy or by overlapping token windows.",
+)
+parser.add_argument("--backend", choices=["torch", "onnx"], default="torch", help="ONNX needs an exported model path.")
+parser.add_argument("--intra_op_threads", type=int, default=None, help="Threads used inside one ONNX operator.")
+parser.add_argument("--inter_op_threads", type=int, default=None, help="Threads used across ONNX operators.")
+parser.add_argument("--quantize", action="store_true", help="Run an int8 dynamically quantized model on cpu.")
+parser.add_argument("--quantized_path", type=str, default=None, help="Where to cache the quantized weights.")
+parser.add_argument("--cache_dir", type=str, default=None, help="Directory for the merged model, reused offline.")
+parser.add_argument("--revision", type=str, default=None, help="Revision of the adapter on HF.")
+parser.add_argument("--cache_size", type=int, default=0, help="Max number of cached chunk results, 0 disables it.")
+parser.add_argument("--cache_max_chars", type=int, default=None, help="Max number of characters held by the cache.")
+parser.add_argument("--fast", action="store_true", help="SDPA attention, bf16 autocast and torch.compile.")
+parser.add_argument("--no_bf16", action="store_true", help="Keep fp32 in the fast path, also on bf16 hardware.")
+parser.add_argument("--max_wait_ms", type=float, default=5.0, help="How long to wait for more requests to batch.")
+parser.add_argument("--max_batch_size", type=int, default=32, help="Max number of requests batched together.")
+parser.add_argument("--max_batch_tokens", type=int, default=4096, help="Max number of tokens batched together.")
+parser.add_argument("--workers", type=int, default=1, help="Server processes sharing one copy of the model.")
+parser.add_argument(
+    "--threads_per_worker", type=int, default=None, help="Torch threads per worker, cores split evenly."
+)
+parser.add_argument("--no_sessions", action="store_true", help="Disable document sessions, needed for --workers > 1.")
 
-app = FastAPI()
 comma_fixer = None
+scheduler = None
+sessions = SessionStore(MAX_SESSIONS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    scheduler.start()
+    yield
+    await scheduler.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.post("/", response_model=FixedText, status_code=200)
-def fix_commas(data: InputText):
+async def fix_commas(data: InputText):
+    REQUESTS.labels("/").inc()
     input_text = data.input_text
     logger.debug(f"Got the incomming text: {input_text}")
-    text_with_commas = comma_fixer.fix_commas(input_text)
+    text_with_commas = await scheduler.fix_commas(input_text)
     logger.debug(f"Model response: {text_with_commas}")
     return {"text_with_commas": text_with_commas, "original_text": input_text}
 
 
+@app.post("/batch", response_model=BatchOutput, status_code=200)
+async def fix_commas_batch(data: BatchInput):
+    REQUESTS.labels("/batch").inc()
+    texts = data.texts
+    if len(texts) > MAX_BATCH_TEXTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_TEXTS} texts are allowed per request.")
+    if sum(len(text) for text in texts) > MAX_BATCH_CHARS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_CHARS} characters are allowed per request.")
+    logger.debug(f"Got a batch of {len(texts)} texts.")
+
+    async def fix_one(text: str) -> dict:
+        if len(text) > MAX_TEXT_CHARS:
+            return {"original_text": text, "error": f"Text is longer than {MAX_TEXT_CHARS} characters."}
+        try:
+            return {"original_text": text, "text_with_commas": await scheduler.fix_commas(text)}
+        except Exception as e:
+            return {"original_text": text, "error": str(e)}
+
+    # All texts go to the scheduler at once, so they share padded forward passes.
+    return {"results": await asyncio.gather(*[fix_one(text) for text in texts])}
+
+
+@app.post("/stream", status_code=200)
+async def fix_commas_stream(request: Request):
+    # Reads plain text, also with chunked transfer encoding, and answers with one JSON line per fixed segment.
+    REQUESTS.labels("/stream").inc()
+
+    async def fixed_lines():
+        segments = stream_fixed_segments(
+            request.stream(), scheduler.fix_commas, STREAM_SEGMENT_CHARS, STREAM_MAX_IN_FLIGHT
+        )
+        async for text_with_commas in segments:
+            yield json.dumps({"text_with_commas": text_with_commas}) + "\n"
+
+    return BodyStreamingResponse(fixed_lines(), media_type="application/x-ndjson")
+
+
+async def update_session(session_id: str, session: DocumentSession, input_text: str) -> dict:
+    changes = await session.update(input_text, scheduler.fix_commas)
+    return {"session_id": session_id, "version": session.version, "changes": changes}
+
+
+def check_document_size(input_text: str):
+    if len(input_text) > MAX_SESSION_CHARS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_SESSION_CHARS} characters are allowed per document.")
+
+
+def get_store() -> SessionStore:
+    if sessions is None:
+        raise HTTPException(status_code=404, detail="Document sessions are disabled on this service.")
+    return sessions
+
+
+def get_session(session_id: str) -> DocumentSession:
+    session = get_store().get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} does not exist or has expired.")
+    return session
+
+
+@app.post("/sessions", response_model=SessionOutput, status_code=201)
+async def create_session(data: InputText):
+    # The first version of the document comes back as one change that covers the whole text.
+    REQUESTS.labels("/sessions").inc()
+    check_document_size(data.input_text)
+    session_id, session = get_store().create()
+    return await update_session(session_id, session, data.input_text)
+
+
+@app.put("/sessions/{session_id}", response_model=SessionOutput, status_code=200)
+async def edit_session(session_id: str, data: InputText):
+    # Only segments that changed since the previous version go through the model.
+    REQUESTS.labels("/sessions").inc()
+    check_document_size(data.input_text)
+    return await update_session(session_id, get_session(session_id), data.input_text)
+
+
+@app.get("/sessions/{session_id}", response_model=SessionText, status_code=200)
+def read_session(session_id: str):
+    session = get_session(session_id)
+    return {"session_id": session_id, "version": session.version, "text_with_commas": session.text_with_commas}
+
+
+@app.delete("/sessions/{session_id}", status_code=204)
+def delete_session(session_id: str):
+    if not get_store().delete(session_id):
+        raise HTTPException(status_code=404, detail=f"Session {session_id} does not exist or has expired.")
+
+
+@app.get("/cache", response_model=CacheStats, status_code=200)
+def cache_stats():
+    if comma_fixer.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **comma_fixer.cache.stats()}
+
+
+@app.get("/metrics", status_code=200)
+def prometheus_metrics():
+    # Prometheus text format, stage latencies tell tokenization cost apart from the forward pass.
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    # With several workers, every process writes its metrics to that directory and they are summed up here.
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
 if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.workers > 1 and args.backend == "onnx":
+        # ONNX Runtime starts its thread pools with the session, and they do not survive a fork.
+        parser.error("--workers > 1 is only supported with the torch backend, use --intra_op_threads for ONNX.")
+    if args.workers > 1 and not args.no_sessions:
+        # Sessions live in the memory of one process, and requests of a session would reach other workers.
+        parser.error("--workers > 1 needs --no_sessions, document sessions only work with a single worker.")
+    if args.no_sessions:
+        sessions = None
     logger.info("Booting up a CommaFixer service...")
-    comma_fixer = CommaFixer(config_path, args.device)
-    uvicorn.run(app, host="0.0.0.0", port=args.port)
+    comma_fixer = CommaFixer(
+        args.model,
+        args.device,
+        args.batch_size,
+        chunking=args.chunking,
+        backend=args.backend,
+        intra_op_threads=args.intra_op_threads,
+        inter_op_threads=args.inter_op_threads,
+        quantize=args.quantize,
+        quantized_path=args.quantized_path,
+        cache_dir=args.cache_dir,
+        revision=args.revision,
+        cache_size=args.cache_size,
+        cache_max_chars=args.cache_max_chars,
+        fast=args.fast,
+        bf16=False if args.no_bf16 else None,
+    )
+    # Compilation and lazy loading happen here, before the fork, so neither the workers nor first requests pay them.
+    start_time = time.time()
+    comma_fixer.warmup()
+    logger.info(f"Warm-up took {time.time() - start_time:.1f} secs.")
+    scheduler = BatchScheduler(comma_fixer, args.max_wait_ms, args.max_batch_size, args.max_batch_tokens)
+    if args.workers > 1:
+        # The model is loaded once above, forked workers share its weights copy-on-write.
+        serve(app, "0.0.0.0", args.port, args.workers, args.threads_per_worker)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=args.port)
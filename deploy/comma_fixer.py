@@ -1,90 +1,454 @@
+import functools
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
 import torch
 from params import ID2LABEL, LABEL2ID
-from peft import PeftConfig, PeftModel
-from transformers import AutoModelForTokenClassification, AutoTokenizer
+from transformers import AutoConfig, AutoModelForTokenClassification, AutoTokenizer
 import warnings
+from typing import Optional
 from logger import logger as base_logger
+from metrics import CHUNKS_PER_TEXT, FORWARD_BATCH_SIZE, INPUT_CHARS, STAGE_SECONDS, TOKENS
 import time
-import spacy
 
-nlp = spacy.load("en_core_web_sm")
+
+@functools.lru_cache(maxsize=None)
+def _load_spacy():
+    # spaCy is only needed to split long texts by sentences, so it is loaded on first use.
+    import spacy
+
+    return spacy.load("en_core_web_sm")
+
 
 logger = base_logger.bind(corr_id="CommaFixer ")
 
+ONNX_MODEL_NAME = "model.onnx"
+ADAPTER_CONFIG_NAME = "adapter_config.json"
+# Smallest padded length of the fast path, shorter windows are padded up to it.
+MIN_BUCKET_LENGTH = 16
+
+
+def _bucket(size: int, smallest: int, largest: int) -> int:
+    # Powers of two from `smallest` capped at `largest`, so a compiled model only ever sees a few shapes.
+    bucket = smallest
+    while bucket < size:
+        bucket *= 2
+    return bucket if size > largest else min(bucket, largest)
+
+
+def _buckets(smallest: int, largest: int) -> list[int]:
+    buckets = [smallest]
+    while buckets[-1] < largest:
+        buckets.append(_bucket(buckets[-1] + 1, smallest, largest))
+    return buckets
+
+
+def _supports_bf16(device: str) -> bool:
+    if torch.device(device).type == "cuda":
+        return torch.cuda.is_bf16_supported()
+    # On CPU bf16 is only faster with AVX512-BF16 or AMX kernels, otherwise it is emulated.
+    return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+
+
+def _make_batches(lengths: list[int], batch_size: int, max_tokens: Optional[int] = None) -> list[list[int]]:
+    batches, current = [], []
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # Lengths are ascending, so the padded size of a batch is set by the item being added.
+        too_many_tokens = max_tokens is not None and (len(current) + 1) * lengths[i] > max_tokens
+        if current and (len(current) == batch_size or too_many_tokens):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+class ChunkCache:
+    """LRU cache from a comma-stripped chunk to the same chunk with restored commas."""
+
+    def __init__(self, max_entries: int, max_chars: Optional[int] = None) -> None:
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.entries = OrderedDict()
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, chunk: str) -> Optional[str]:
+        with self.lock:
+            fixed = self.entries.get(chunk)
+            if fixed is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(chunk)
+            self.hits += 1
+            return fixed
+
+    def put(self, chunk: str, fixed: str):
+        with self.lock:
+            if chunk in self.entries:
+                return
+            self.entries[chunk] = fixed
+            self.chars += len(chunk) + len(fixed)
+            while len(self.entries) > self.max_entries or (self.max_chars is not None and self.chars > self.max_chars):
+                old_chunk, old_fixed = self.entries.popitem(last=False)
+                self.chars -= len(old_chunk) + len(old_fixed)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "chars": self.chars,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
 
 class CommaFixer:
-    def __init__(self, config_path: str, device: str) -> None:
+    def __init__(
+        self,
+        config_path: str,
+        device: str,
+        batch_size: int = 16,
+        max_tokens: Optional[int] = None,
+        chunking: str = "sentence",
+        window_size: int = 512,
+        window_overlap: int = 128,
+        backend: str = "torch",
+        intra_op_threads: Optional[int] = None,
+        inter_op_threads: Optional[int] = None,
+        quantize: bool = False,
+        quantized_path: Optional[str] = None,
+        cache_dir: Optional[str] = None,
+        revision: Optional[str] = None,
+        cache_size: int = 0,
+        cache_max_chars: Optional[int] = None,
+        fast: bool = False,
+        bf16: Optional[bool] = None,
+    ) -> None:
+        if chunking not in ("sentence", "window"):
+            raise ValueError(f"Unknown chunking mode: {chunking}")
+        if backend not in ("torch", "onnx"):
+            raise ValueError(f"Unknown backend: {backend}")
+        if quantize and (backend != "torch" or device != "cpu"):
+            raise ValueError("Dynamic quantization is only supported by the torch backend on cpu.")
+        if fast and (backend != "torch" or quantize):
+            raise ValueError("The fast path is only supported by the torch backend without quantization.")
         self.config_path = config_path
         self.device = device
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.chunking = chunking
+        self.window_size = window_size
+        self.window_overlap = window_overlap
+        self.backend = backend
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.quantize = quantize
+        self.quantized_path = quantized_path
+        self.cache_dir = cache_dir
+        self.revision = revision
+        self.cache = ChunkCache(cache_size, cache_max_chars) if cache_size else None
+        self.fast = fast
+        # bf16 autocast is part of the fast path and is used where the hardware supports it, unless set explicitly.
+        self.bf16 = fast and (bf16 if bf16 is not None else _supports_bf16(device))
         logger.debug(f"Loading a model from {config_path} to {device}")
         model, tokenizer = self.prepare_model(self.config_path, self.device)
         self.model = model
         self.tokenizer = tokenizer
+        self.model_config = AutoConfig.from_pretrained(config_path) if backend == "onnx" else model.config
+        if self.window_size - self.tokenizer.num_special_tokens_to_add() <= self.window_overlap:
+            raise ValueError("window_overlap should be smaller than window_size without special tokens.")
 
     def prepare_model(self, config_path: str, device: str):
-        config = PeftConfig.from_pretrained(config_path)
-        inference_model = AutoModelForTokenClassification.from_pretrained(
-            config.base_model_name_or_path,
-            num_labels=2,
-            id2label=ID2LABEL,
-            label2id=LABEL2ID,
-        )
-        tokenizer = AutoTokenizer.from_pretrained(config.base_model_name_or_path, add_prefix_space=True)
-        model = PeftModel.from_pretrained(inference_model, config_path)
-        model = model.merge_and_unload()
+        if self.backend == "onnx":
+            tokenizer = AutoTokenizer.from_pretrained(config_path, add_prefix_space=True)
+            return self.__prepare_onnx_session(config_path), tokenizer
+        from peft import PeftConfig, PeftModel
+
+        merged_path = self.__merged_model_path(config_path)
+        adapter_config = None
+        if merged_path and os.path.isdir(merged_path):
+            # The merged model is loaded from local safetensors files, nothing is downloaded or merged again.
+            model_source = merged_path
+            tokenizer = AutoTokenizer.from_pretrained(merged_path, add_prefix_space=True)
+        else:
+            if self.__has_adapter(config_path):
+                adapter_config = PeftConfig.from_pretrained(config_path, revision=self.revision)
+                model_source = adapter_config.base_model_name_or_path
+            else:
+                # A distilled student or any other full model has no LoRa adapter to merge.
+                model_source = config_path
+            tokenizer = AutoTokenizer.from_pretrained(model_source, add_prefix_space=True)
+        state_dict = self.__read_quantized_weights(config_path) if self.quantize and self.quantized_path else None
+        if state_dict is not None:
+            return self.__load_quantized_model(model_source, state_dict), tokenizer
+
+        if model_source == merged_path:
+            model = self.__from_pretrained(merged_path)
+        elif adapter_config is None:
+            model = self.__from_pretrained(config_path, revision=self.revision)
+        else:
+            inference_model = self.__from_pretrained(
+                model_source,
+                num_labels=2,
+                id2label=ID2LABEL,
+                label2id=LABEL2ID,
+            )
+            model = PeftModel.from_pretrained(inference_model, config_path, revision=self.revision)
+            model = model.merge_and_unload()
+            if merged_path:
+                self.__save_merged_model(model, tokenizer, merged_path)
+        if self.quantize:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            if self.quantized_path:
+                # The weights are stored with the model they come from, so another model never loads them.
+                torch.save(
+                    {"model": self.__quantized_key(config_path), "state_dict": model.state_dict()}, self.quantized_path
+                )
         model.to(device)
         model.eval()
+        if self.fast:
+            # Every bucketed shape is compiled once, the limit keeps dynamo from falling back to eager mode.
+            # It is doubled to leave room for larger batches passed to `fix_commas_batch`.
+            num_shapes = len(_buckets(MIN_BUCKET_LENGTH, self.window_size)) * len(_buckets(1, self.batch_size))
+            torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 2 * num_shapes)
+            model = torch.compile(model, dynamic=False)
         return model, tokenizer
 
-    def __infer(self, text):
-        tokenized = self.tokenizer(
-            text, return_tensors="pt", padding=True, return_offsets_mapping=True, return_length=True
+    def __has_adapter(self, config_path: str) -> bool:
+        if os.path.isdir(config_path):
+            return os.path.isfile(os.path.join(config_path, ADAPTER_CONFIG_NAME))
+        from huggingface_hub import file_exists, try_to_load_from_cache
+
+        # A cached adapter config is enough, so starts without network access still find the adapter.
+        if isinstance(try_to_load_from_cache(config_path, ADAPTER_CONFIG_NAME, revision=self.revision), str):
+            return True
+        return file_exists(config_path, ADAPTER_CONFIG_NAME, revision=self.revision)
+
+    def __from_pretrained(self, model_source: str, **kwargs):
+        if self.fast:
+            try:
+                return AutoModelForTokenClassification.from_pretrained(
+                    model_source, attn_implementation="sdpa", **kwargs
+                )
+            except ValueError:
+                logger.warning(f"{model_source} does not support SDPA attention, the eager one is used.")
+        return AutoModelForTokenClassification.from_pretrained(model_source, **kwargs)
+
+    def __merged_model_path(self, config_path: str) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        adapter_id = config_path.strip("/").replace("/", "--")
+        return os.path.join(self.cache_dir, f"{adapter_id}@{self.revision or 'main'}")
+
+    def __save_merged_model(self, model, tokenizer, merged_path: str):
+        # Write into a temporary directory first, so a crash or a concurrent start never leaves a partial cache.
+        tmp_path = f"{merged_path}.tmp-{os.getpid()}"
+        model.save_pretrained(tmp_path, safe_serialization=True)
+        tokenizer.save_pretrained(tmp_path)
+        try:
+            os.replace(tmp_path, merged_path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def __quantized_key(self, config_path: str) -> str:
+        return f"{config_path}@{self.revision or 'main'}"
+
+    def __read_quantized_weights(self, config_path: str) -> Optional[dict]:
+        if not os.path.exists(self.quantized_path):
+            return None
+        checkpoint = torch.load(self.quantized_path)
+        if not isinstance(checkpoint, dict) or checkpoint.get("model") != self.__quantized_key(config_path):
+            logger.warning(f"{self.quantized_path} holds weights of another model, it is quantized again.")
+            return None
+        return checkpoint["state_dict"]
+
+    def __load_quantized_model(self, model_source: str, state_dict: dict):
+        # Quantize an empty model of the same architecture, so the cached int8 weights fit into it.
+        model_config = AutoConfig.from_pretrained(model_source, num_labels=2, id2label=ID2LABEL, label2id=LABEL2ID)
+        model = AutoModelForTokenClassification.from_config(model_config)
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        model.load_state_dict(state_dict)
+        model.eval()
+        return model
+
+    def __prepare_onnx_session(self, model_dir: str):
+        # The ONNX backend runs on CPU only, so the device is ignored.
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.intra_op_threads:
+            options.intra_op_num_threads = self.intra_op_threads
+        if self.inter_op_threads:
+            options.inter_op_num_threads = self.inter_op_threads
+        return ort.InferenceSession(
+            os.path.join(model_dir, ONNX_MODEL_NAME), options, providers=["CPUExecutionProvider"]
         )
-        tokenized.to(self.model.device)
-        start = time.time()
-        with torch.inference_mode():
-            logits = self.model(tokenized["input_ids"], tokenized["attention_mask"]).logits
-        tokens = tokenized.tokens()
-        predictions = torch.argmax(logits, dim=2).detach().cpu()
-        labels = [self.model.config.id2label[prediction] for prediction in predictions[0].numpy()]
-        logger.debug(f"Inference took {(time.time() - start):.3f} secs.")
-        return tokens, labels, tokenized["offset_mapping"][0].detach().cpu().numpy()
-
-    def __fix_commas_based_on_labels_and_offsets(
-        self, labels: list[str], original_text: str, offset_map: list[tuple[int, int]]
-    ) -> str:
-        result = original_text
-        commas_inserted = 0
 
-        for i, label in enumerate(labels):
-            current_offset = offset_map[i][1] + commas_inserted
-            if label == "B-COMMA" and result[current_offset].isspace():
-                result = result[:current_offset] + "," + result[current_offset:]
-                commas_inserted += 1
-        return result
+    def __pad_to_bucket(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        num_rows, length = input_ids.shape
+        shape = (_bucket(num_rows, 1, self.batch_size), _bucket(length, MIN_BUCKET_LENGTH, self.window_size))
+        padded_ids = np.full(shape, self.tokenizer.pad_token_id, dtype=input_ids.dtype)
+        padded_mask = np.zeros(shape, dtype=attention_mask.dtype)
+        padded_ids[:num_rows, :length] = input_ids
+        padded_mask[:num_rows, :length] = attention_mask
+        # Extra rows repeat the first one, a row without attended tokens would give NaNs in SDPA.
+        padded_ids[num_rows:] = padded_ids[0]
+        padded_mask[num_rows:] = padded_mask[0]
+        return padded_ids, padded_mask
+
+    def __forward(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.backend == "onnx":
+            return self.model.run(["logits"], {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+        num_rows, length = input_ids.shape
+        if self.fast:
+            input_ids, attention_mask = self.__pad_to_bucket(input_ids, attention_mask)
+        device = self.model.device
+        with torch.inference_mode(), torch.autocast(device.type, dtype=torch.bfloat16, enabled=self.bf16):
+            logits = self.model(
+                torch.from_numpy(input_ids).to(device),
+                torch.from_numpy(attention_mask).to(device),
+            ).logits
+        return logits[:num_rows, :length].float().cpu().numpy()
+
+    def warmup(self):
+        """Runs the model before the first request, in fast mode once for every bucketed shape to compile them."""
+        if self.chunking == "sentence":
+            _load_spacy()
+        num_rows, lengths = [1], [MIN_BUCKET_LENGTH]
+        if self.fast:
+            num_rows, lengths = _buckets(1, self.batch_size), _buckets(MIN_BUCKET_LENGTH, self.window_size)
+        for rows in num_rows:
+            for length in lengths:
+                input_ids = np.full((rows, length), self.tokenizer.pad_token_id, dtype=np.int64)
+                input_ids[:, 0] = self.tokenizer.cls_token_id
+                self.__forward(input_ids, np.ones((rows, length), dtype=np.int64))
+
+    def __window_starts(self, num_tokens: int, size: int) -> list[int]:
+        starts = [0]
+        while starts[-1] + size < num_tokens:
+            starts.append(starts[-1] + size - self.window_overlap)
+        return starts
+
+    def __infer_batch(
+        self, texts: list[str], batch_size: int, max_tokens: Optional[int]
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        if not texts:
+            return []
+        # Every chunk is tokenized once and cut into overlapping windows that fit the model.
+        # Windows are run sorted by length, so each padded batch wastes as little as possible.
+        with STAGE_SECONDS.labels("tokenization").time():
+            tokenized = self.tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+            num_special_tokens = self.tokenizer.num_special_tokens_to_add()
+            size = self.window_size - num_special_tokens
+            windows = []
+            for i, ids in enumerate(tokenized["input_ids"]):
+                for start in self.__window_starts(len(ids), size):
+                    windows.append(
+                        (i, start, self.tokenizer.build_inputs_with_special_tokens(ids[start : start + size]))
+                    )
+        TOKENS.inc(sum(len(window[2]) for window in windows))
+        logits = [np.zeros((len(ids), self.model_config.num_labels)) for ids in tokenized["input_ids"]]
+
+        for indices in _make_batches([len(window[2]) for window in windows], batch_size, max_tokens):
+            with STAGE_SECONDS.labels("tokenization").time():
+                batch = self.tokenizer.pad({"input_ids": [windows[j][2] for j in indices]}, return_tensors="np")
+            FORWARD_BATCH_SIZE.observe(len(indices))
+            start_time = time.time()
+            batch_logits = self.__forward(batch["input_ids"], batch["attention_mask"])
+            forward_secs = time.time() - start_time
+            STAGE_SECONDS.labels("forward").observe(forward_secs)
+            logger.debug(f"Inference of {len(indices)} windows took {forward_secs:.3f} secs.")
+            for row, j in enumerate(indices):
+                i, start, input_ids = windows[j]
+                length = len(input_ids) - num_special_tokens
+                # Overlapping windows vote by summing their logits, the first position holds the <s> token.
+                logits[i][start : start + length] += batch_logits[row, 1 : 1 + length]
+
+        return [
+            (np.argmax(chunk_logits, axis=1), np.array(tokenized["offset_mapping"][i]).reshape(-1, 2))
+            for i, chunk_logits in enumerate(logits)
+        ]
+
+    def __fix_commas_based_on_predictions_and_offsets(
+        self, predictions: np.ndarray, original_text: str, offset_map: np.ndarray
+    ) -> str:
+        # A comma goes right after every B-COMMA token that is followed by a whitespace.
+        ends = np.unique(offset_map[predictions == self.model_config.label2id["B-COMMA"], 1])
+        positions = [end for end in ends[ends < len(original_text)] if original_text[end].isspace()]
+        segments = [original_text[start:end] for start, end in zip([0] + positions, positions + [len(original_text)])]
+        return ",".join(segments)
 
     def remove_commas(self, text) -> str:
         text = text.replace(",", "")
         return text
 
     def __split_by_sentence(self, text) -> list:
-        doc = nlp(text)
-        sentences = [str(sent) for sent in doc.sents]
+        doc = _load_spacy()(text)
+        # Sentences keep the whitespace after them, so put together they give the text back.
+        sentences = [sent.text_with_ws for sent in doc.sents]
         return sentences
 
-    def fix_commas(self, text: str) -> str:
-        result = []
-        text = self.remove_commas(text)
-        if len(text) > 512:
-            text = self.__split_by_sentence(text)
-        else:
-            text = [text]
-        for t in text:
-            _, predictions, offset = self.__infer(t)
-            res = self.__fix_commas_based_on_labels_and_offsets(predictions, t, offset)
-            result.append(res)
+    def __split_into_chunks(self, text: str) -> list[str]:
+        with STAGE_SECONDS.labels("remove_commas").time():
+            text = self.remove_commas(text)
+        if self.chunking == "sentence" and len(text) > 512:
+            with STAGE_SECONDS.labels("sentence_split").time():
+                return self.__split_by_sentence(text)
+        return [text]
+
+    def fix_commas_batch(
+        self, texts: list[str], batch_size: Optional[int] = None, max_tokens: Optional[int] = None
+    ) -> list[str]:
+        # Chunks of all documents share one queue, so a batch can span several short documents.
+        chunks, owners, tails = [], [], []
+        for i, text in enumerate(texts):
+            INPUT_CHARS.inc(len(text))
+            text_chunks = self.__split_into_chunks(text)
+            CHUNKS_PER_TEXT.observe(len(text_chunks))
+            for chunk in text_chunks:
+                # Trailing whitespace stays out of the model and is put back after the fixed chunk.
+                stripped = chunk.rstrip()
+                chunks.append(stripped)
+                owners.append(i)
+                tails.append(chunk[len(stripped) :])
+
+        # Only chunks that are neither cached nor repeated within this call go through the model.
+        fixed_chunks = {}
+        for chunk in chunks:
+            if chunk not in fixed_chunks:
+                fixed_chunks[chunk] = self.cache.get(chunk) if self.cache is not None else None
+        missing = [chunk for chunk, fixed in fixed_chunks.items() if fixed is None]
+        predictions = self.__infer_batch(
+            missing, batch_size or self.batch_size, max_tokens if max_tokens is not None else self.max_tokens
+        )
+        with STAGE_SECONDS.labels("postprocess").time():
+            for chunk, (chunk_predictions, offset) in zip(missing, predictions):
+                fixed_chunks[chunk] = self.__fix_commas_based_on_predictions_and_offsets(
+                    chunk_predictions, chunk, offset
+                )
+                if self.cache is not None:
+                    self.cache.put(chunk, fixed_chunks[chunk])
+
+        result = [[] for _ in texts]
+        for owner, chunk, tail in zip(owners, chunks, tails):
+            result[owner].append(fixed_chunks[chunk] + tail)
+        return ["".join(fixed) for fixed in result]
 
-        return " ".join(result)
+    def fix_commas(self, text: str) -> str:
+        return self.fix_commas_batch([text])[0]
 
 
 if __name__ == "__main__":
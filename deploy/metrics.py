@@ -0,0 +1,30 @@
+from prometheus_client import Counter, Histogram
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+# Time spent in every stage of CommaFixer.fix_commas_batch.
+STAGE_SECONDS = Histogram(
+    "comma_fixer_stage_seconds",
+    "Time spent in each processing stage.",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+
+REQUESTS = Counter("comma_fixer_requests_total", "Number of requests.", ["endpoint"])
+INPUT_CHARS = Counter("comma_fixer_input_chars_total", "Number of input characters.")
+TOKENS = Counter("comma_fixer_tokens_total", "Number of tokens run through the model, with special tokens.")
+CHUNKS_PER_TEXT = Histogram(
+    "comma_fixer_chunks_per_text", "Number of chunks a text is split into.", buckets=SIZE_BUCKETS
+)
+FORWARD_BATCH_SIZE = Histogram(
+    "comma_fixer_forward_batch_size", "Number of windows in one forward pass.", buckets=SIZE_BUCKETS
+)
+SCHEDULER_BATCH_SIZE = Histogram(
+    "comma_fixer_scheduler_batch_size", "Number of requests batched by the scheduler.", buckets=SIZE_BUCKETS
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "comma_fixer_queue_wait_seconds",
+    "Time a request waits in the scheduler queue.",
+    buckets=STAGE_BUCKETS,
+)
@@ -1,5 +1,18 @@
 config_path = "just097/roberta-base-lora-comma-placement-r-16-alpha-32"
 
+# Batch scheduler: average characters per token, used to estimate the tokens of a request.
+CHARS_PER_TOKEN = 4
+# Streaming endpoint: characters per fixed segment and segments processed at once.
+STREAM_SEGMENT_CHARS = 2048
+STREAM_MAX_IN_FLIGHT = 4
+# Batch endpoint: max number of texts, characters in all texts and characters in one text.
+MAX_BATCH_TEXTS = 256
+MAX_BATCH_CHARS = 1_000_000
+MAX_TEXT_CHARS = 100_000
+# Document sessions: max number of kept sessions and characters in one document.
+MAX_SESSIONS = 1000
+MAX_SESSION_CHARS = 1_000_000
+
 ID2LABEL = {0: "O", 1: "B-COMMA"}
 LABEL2ID = {"O": 0, "B-COMMA": 1}
 LABEL_LIST = ["O", "B-COMMA"]
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from logger import logger as base_logger
+from metrics import QUEUE_WAIT_SECONDS, SCHEDULER_BATCH_SIZE
+from params import CHARS_PER_TOKEN
+
+logger = base_logger.bind(corr_id="Scheduler ")
+
+
+class BatchScheduler:
+    """Coalesces concurrent requests into batched CommaFixer calls run by a single inference thread."""
+
+    def __init__(self, comma_fixer, max_wait_ms: float = 5.0, max_batch_size: int = 32, max_batch_tokens: int = 4096):
+        self.comma_fixer = comma_fixer
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.queue = None
+        self.worker = None
+        self.pending = None
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown(wait=True)
+
+    async def fix_commas(self, text: str) -> str:
+        future = asyncio.get_running_loop().create_future()
+        # Estimated from the length, tokenizing a large text here would block every other request.
+        num_tokens = len(text) // CHARS_PER_TOKEN + 1
+        await self.queue.put((text, num_tokens, future, time.time()))
+        return await future
+
+    async def __next_request(self, timeout: float = None):
+        if self.pending is not None:
+            request, self.pending = self.pending, None
+            return request
+        if timeout is None:
+            return await self.queue.get()
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    async def __collect_batch(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self.__next_request()]
+        num_tokens = batch[0][1]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                request = await self.__next_request(timeout)
+            except asyncio.TimeoutError:
+                break
+            if num_tokens + request[1] > self.max_batch_tokens:
+                # Keep the request for the next batch instead of overflowing the token budget.
+                self.pending = request
+                break
+            batch.append(request)
+            num_tokens += request[1]
+        return batch
+
+    def __fix_one_by_one(self, texts: list[str]) -> list:
+        results = []
+        for text in texts:
+            try:
+                results.append(self.comma_fixer.fix_commas(text))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    async def __run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.__collect_batch()
+            texts = [text for text, _, _, _ in batch]
+            start = time.time()
+            SCHEDULER_BATCH_SIZE.observe(len(batch))
+            for _, _, _, enqueued in batch:
+                QUEUE_WAIT_SECONDS.observe(start - enqueued)
+            try:
+                results = await loop.run_in_executor(self.executor, self.comma_fixer.fix_commas_batch, texts)
+            except Exception:
+                # Retry the requests one by one, so a single bad text does not fail the others.
+                logger.exception(f"Batch of {len(batch)} requests failed, retrying them one by one.")
+                results = await loop.run_in_executor(self.executor, self.__fix_one_by_one, texts)
+            logger.debug(f"Batch of {len(batch)} requests took {(time.time() - start):.3f} secs.")
+            for (_, _, future, _), result in zip(batch, results):
+                # The client may have gone away while the batch was running.
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
@@ -0,0 +1,90 @@
+import asyncio
+import hashlib
+import uuid
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from itertools import accumulate
+from typing import Awaitable, Callable, Optional
+
+from streaming import sentence_end
+
+
+def split_segments(text: str) -> list[str]:
+    # Cut after every sentence end or line break, the segments put together give the text back.
+    segments, start = [], 0
+    for match in sentence_end.finditer(text):
+        segments.append(text[start : match.end()])
+        start = match.end()
+    if start < len(text):
+        segments.append(text[start:])
+    return segments
+
+
+def _segment_hash(segment: str) -> bytes:
+    return hashlib.blake2b(segment.encode("utf-8"), digest_size=16).digest()
+
+
+class DocumentSession:
+    """Fixed segments of one document, an update only sends the segments that changed through the model."""
+
+    def __init__(self) -> None:
+        self.hashes = []
+        self.fixed = []
+        self.version = 0
+        self.lock = asyncio.Lock()
+
+    @property
+    def text_with_commas(self) -> str:
+        return "".join(self.fixed)
+
+    async def update(self, text: str, fix_commas: Callable[[str], Awaitable[str]]) -> list[dict]:
+        async with self.lock:
+            segments = split_segments(text)
+            hashes = [_segment_hash(segment) for segment in segments]
+            opcodes = SequenceMatcher(None, self.hashes, hashes, autojunk=False).get_opcodes()
+
+            # Segments that were only moved keep their result, the rest are fixed at once, so they share batches.
+            known = dict(zip(self.hashes, self.fixed))
+            changed = [j for tag, _, _, j1, j2 in opcodes if tag != "equal" for j in range(j1, j2)]
+            missing = list({hashes[j]: j for j in changed if hashes[j] not in known}.values())
+            results = await asyncio.gather(*[fix_commas(segments[j]) for j in missing])
+            known.update((hashes[j], fixed) for j, fixed in zip(missing, results))
+
+            # Changes are spans of the previous text with commas, to be replaced with the new text.
+            offsets = [0] + list(accumulate(len(fixed) for fixed in self.fixed))
+            fixed, changes = [], []
+            for tag, i1, i2, j1, j2 in opcodes:
+                if tag == "equal":
+                    fixed.extend(self.fixed[i1:i2])
+                    continue
+                new_fixed = [known[hashes[j]] for j in range(j1, j2)]
+                fixed.extend(new_fixed)
+                changes.append({"start": offsets[i1], "end": offsets[i2], "text_with_commas": "".join(new_fixed)})
+
+            self.hashes, self.fixed = hashes, fixed
+            self.version += 1
+            return changes
+
+
+class SessionStore:
+    """Keeps the most recently used sessions, the oldest one is dropped when there are too many."""
+
+    def __init__(self, max_sessions: int) -> None:
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+
+    def create(self) -> tuple[str, DocumentSession]:
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = DocumentSession()
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+        return session_id, self.sessions[session_id]
+
+    def get(self, session_id: str) -> Optional[DocumentSession]:
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        return self.sessions.pop(session_id, None) is not None
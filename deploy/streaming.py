@@ -0,0 +1,64 @@
+import asyncio
+import codecs
+import re
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable
+
+from fastapi.responses import StreamingResponse
+
+sentence_end = re.compile(r"[.!?]\s+|\n+")
+whitespace = re.compile(r"\s+")
+
+
+class BodyStreamingResponse(StreamingResponse):
+    # The request body is still being read while the response streams, so only the body reader may call receive().
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+
+def split_complete_text(buffer: str, segment_chars: int) -> tuple[str, str]:
+    # Cut after the last sentence end within `segment_chars`, or the first one after it,
+    # so a sentence is never split between two segments.
+    if len(buffer) < segment_chars:
+        return "", buffer
+    cut = max((match.end() for match in sentence_end.finditer(buffer, 0, segment_chars)), default=0)
+    if cut == 0:
+        match = sentence_end.search(buffer, segment_chars)
+        cut = match.end() if match else 0
+    if cut == 0 and len(buffer) >= 4 * segment_chars:
+        # Without any sentence end, fall back to the last whitespace to keep the buffer bounded.
+        cut = max((match.end() for match in whitespace.finditer(buffer)), default=len(buffer))
+    return buffer[:cut], buffer[cut:]
+
+
+async def stream_fixed_segments(
+    body: AsyncIterator[bytes],
+    fix_commas: Callable[[str], Awaitable[str]],
+    segment_chars: int = 2048,
+    max_in_flight: int = 4,
+) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = deque()
+    buffer = ""
+    try:
+        async for data in body:
+            buffer += decoder.decode(data)
+            # One read may hold several segments, when the client sends faster than they are fixed.
+            segment, buffer = split_complete_text(buffer, segment_chars)
+            while segment:
+                # Segments are fixed concurrently, so the scheduler can batch them, but returned in order.
+                pending.append(asyncio.ensure_future(fix_commas(segment)))
+                while len(pending) >= max_in_flight or (pending and pending[0].done()):
+                    yield await pending.popleft()
+                segment, buffer = split_complete_text(buffer, segment_chars)
+            while pending and pending[0].done():
+                yield await pending.popleft()
+        buffer += decoder.decode(b"", final=True)
+        if buffer:
+            pending.append(asyncio.ensure_future(fix_commas(buffer)))
+        while pending:
+            yield await pending.popleft()
+    finally:
+        # The client may disconnect in the middle of the stream.
+        for future in pending:
+            future.cancel()
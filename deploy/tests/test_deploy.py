@@ -18,3 +18,89 @@ def test_fix_commas():
     response = requests.post("http://0.0.0.0:8008/", data)
     assert response.status_code == 200
     assert response.json()["text_with_commas"] == "One, Two, three."
+
+
+def test_cache_stats():
+    response = requests.get("http://0.0.0.0:8008/cache")
+    assert response.status_code == 200
+    assert "enabled" in response.json()
+
+
+def test_stream():
+    def body():
+        yield b"One Two three. "
+        yield b"Four five six."
+
+    response = requests.post("http://0.0.0.0:8008/stream", data=body())
+    assert response.status_code == 200
+    fixed = "".join(json.loads(line)["text_with_commas"] for line in response.text.splitlines())
+    assert fixed.replace(",", "") == "One Two three. Four five six."
+
+
+def test_stream_many_segments():
+    # Several segments of about 2048 characters, each one split into sentences, with line breaks in between.
+    text = "".join(f"Sentence {i} has some words in it.{chr(10) if i % 50 == 49 else ' '}" for i in range(300))
+
+    def body():
+        data = text.encode("utf-8")
+        for start in range(0, len(data), 1000):
+            yield data[start : start + 1000]
+
+    response = requests.post("http://0.0.0.0:8008/stream", data=body())
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert len(lines) > 1
+    fixed = "".join(json.loads(line)["text_with_commas"] for line in lines)
+    assert fixed.replace(",", "") == text
+
+
+def test_batch():
+    data = json.dumps({"texts": ["One Two three.", "Hello"]})
+    response = requests.post("http://0.0.0.0:8008/batch", data)
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["original_text"] for result in results] == ["One Two three.", "Hello"]
+    assert results[0]["text_with_commas"] == "One, Two, three."
+    assert all(result["error"] is None for result in results)
+
+
+def test_batch_too_large():
+    data = json.dumps({"texts": ["Hello"] * 10_000})
+    response = requests.post("http://0.0.0.0:8008/batch", data)
+    assert response.status_code == 413
+
+
+def test_metrics():
+    requests.post("http://0.0.0.0:8008/", json.dumps({"input_text": "One Two three."}))
+    response = requests.get("http://0.0.0.0:8008/metrics")
+    assert response.status_code == 200
+    assert 'comma_fixer_stage_seconds_count{stage="forward"}' in response.text
+    assert 'comma_fixer_requests_total{endpoint="/"}' in response.text
+
+
+def test_sessions():
+    response = requests.post("http://0.0.0.0:8008/sessions", json.dumps({"input_text": "One Two three. Hello"}))
+    assert response.status_code == 201
+    session = response.json()
+    assert session["changes"] == [{"start": 0, "end": 0, "text_with_commas": "One, Two, three. Hello"}]
+
+    url = f"http://0.0.0.0:8008/sessions/{session['session_id']}"
+    response = requests.put(url, json.dumps({"input_text": "One Two three. Hello world"}))
+    assert response.status_code == 200
+    changes = response.json()["changes"]
+    assert [(change["start"], change["end"]) for change in changes] == [(17, 22)]
+    assert requests.get(url).json()["text_with_commas"].startswith("One, Two, three. ")
+
+    assert requests.delete(url).status_code == 204
+    assert requests.get(url).status_code == 404
+
+
+def test_session_keeps_whitespace_of_long_sentences():
+    # Sentences over 512 characters are split by spaCy, the line breaks between them must survive.
+    sentence = " ".join(["word"] * 120) + "."
+    text = f"{sentence}\n{sentence} {sentence}\n\nEnd"
+    response = requests.post("http://0.0.0.0:8008/sessions", json.dumps({"input_text": text}))
+    assert response.status_code == 201
+    session = response.json()
+    assert session["changes"][0]["text_with_commas"].replace(",", "") == text
+    requests.delete(f"http://0.0.0.0:8008/sessions/{session['session_id']}")
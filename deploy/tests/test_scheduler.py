@@ -0,0 +1,80 @@
+import asyncio
+
+from params import CHARS_PER_TOKEN
+from scheduler import BatchScheduler
+
+
+class RecordingFixer:
+    def __init__(self, fail_on: str = None, fail_batches: bool = False):
+        self.batches = []
+        self.fail_on = fail_on
+        self.fail_batches = fail_batches
+
+    def fails(self, text: str) -> bool:
+        return self.fail_batches or (self.fail_on is not None and self.fail_on in text)
+
+    def fix_commas_batch(self, texts):
+        self.batches.append(list(texts))
+        if any(self.fails(text) for text in texts):
+            raise RuntimeError("batch failed")
+        return [text.upper() for text in texts]
+
+    def fix_commas(self, text):
+        # Used when the scheduler retries the texts of a failed batch one by one.
+        if self.fails(text):
+            raise ValueError(f"bad text: {text}")
+        return text.upper()
+
+
+def run(scheduler: BatchScheduler, texts: list[str]) -> list:
+    async def main():
+        scheduler.start()
+        try:
+            requests = [scheduler.fix_commas(text) for text in texts]
+            # A waiter that never gets its result fails the test instead of hanging it.
+            return await asyncio.wait_for(asyncio.gather(*requests, return_exceptions=True), timeout=5)
+        finally:
+            await scheduler.stop()
+
+    return asyncio.run(main())
+
+
+def text_of_tokens(name: str, num_tokens: int) -> str:
+    # The scheduler estimates `len(text) // CHARS_PER_TOKEN + 1` tokens.
+    return name.ljust((num_tokens - 1) * CHARS_PER_TOKEN, ".")
+
+
+def test_results_go_to_their_requests():
+    fixer = RecordingFixer()
+    texts = [f"text {i}" for i in range(10)]
+    assert run(BatchScheduler(fixer, max_wait_ms=50), texts) == [text.upper() for text in texts]
+    assert sum(len(batch) for batch in fixer.batches) == 10
+
+
+def test_token_budget_carries_request_to_next_batch():
+    fixer = RecordingFixer()
+    texts = [text_of_tokens(name, 10) for name in "abc"]
+    results = run(BatchScheduler(fixer, max_wait_ms=50, max_batch_tokens=25), texts)
+    assert results == [text.upper() for text in texts]
+    # The third request would overflow the budget, it starts the next batch instead of being dropped.
+    assert fixer.batches == [texts[:2], texts[2:]]
+
+
+def test_max_batch_size():
+    fixer = RecordingFixer()
+    texts = [f"text {i}" for i in range(5)]
+    run(BatchScheduler(fixer, max_wait_ms=50, max_batch_size=2), texts)
+    assert fixer.batches == [texts[:2], texts[2:4], texts[4:]]
+
+
+def test_bad_text_only_fails_its_own_request():
+    fixer = RecordingFixer(fail_on="bad")
+    results = run(BatchScheduler(fixer, max_wait_ms=50), ["one", "bad one", "two"])
+    assert results[0] == "ONE" and results[2] == "TWO"
+    assert isinstance(results[1], ValueError)
+
+
+def test_failing_fixer_reaches_every_waiter():
+    results = run(BatchScheduler(RecordingFixer(fail_batches=True), max_wait_ms=50), ["one", "two", "three"])
+    assert len(results) == 3
+    assert all(isinstance(result, ValueError) for result in results)
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -8,3 +10,45 @@ class InputText(BaseModel):
 class FixedText(BaseModel):
     text_with_commas: str
     original_text: str
+
+
+class BatchInput(BaseModel):
+    texts: list[str]
+
+
+class BatchItem(BaseModel):
+    original_text: str
+    text_with_commas: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BatchOutput(BaseModel):
+    results: list[BatchItem]
+
+
+class CacheStats(BaseModel):
+    enabled: bool
+    entries: int = 0
+    chars: int = 0
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    hit_rate: float = 0.0
+
+
+class SessionChange(BaseModel):
+    start: int
+    end: int
+    text_with_commas: str
+
+
+class SessionOutput(BaseModel):
+    session_id: str
+    version: int
+    changes: list[SessionChange]
+
+
+class SessionText(BaseModel):
+    session_id: str
+    version: int
+    text_with_commas: str
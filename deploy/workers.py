@@ -0,0 +1,79 @@
+import gc
+import os
+import signal
+import socket
+
+import torch
+import uvicorn
+from logger import logger as base_logger
+
+logger = base_logger.bind(corr_id="Workers ")
+
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock: socket.socket, host: str, port: int, num_threads: int):
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    torch.set_num_threads(num_threads)
+    # Every worker runs its own event loop and scheduler, all of them accept connections from the shared socket.
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port))
+    server.run(sockets=[sock])
+
+
+def serve(app, host: str, port: int, num_workers: int, threads_per_worker: int = None):
+    """Forks `num_workers` servers from this process, so they share the already loaded model weights."""
+    if not hasattr(os, "fork"):
+        raise RuntimeError("Multiple workers need os.fork, run a single worker on this platform.")
+    num_threads = threads_per_worker or max(1, os.cpu_count() // num_workers)
+    # Workers get their parallelism from torch threads, not from the Rust tokenizer threads.
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    multiprocess_metrics = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+    if not multiprocess_metrics:
+        logger.warning("PROMETHEUS_MULTIPROC_DIR is not set, GET /metrics only shows the worker that answers it.")
+
+    sock = _bind_socket(host, port)
+    # Objects that exist before the fork are never moved by the GC, so their memory pages stay shared.
+    gc.freeze()
+    workers = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(app, sock, host, port, num_threads)
+            finally:
+                os._exit(0)
+        workers.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    logger.info(f"Starting {num_workers} workers with {num_threads} torch threads each on {host}:{port}.")
+    for _ in range(num_workers):
+        spawn()
+
+    while workers:
+        pid, status = os.wait()
+        workers.discard(pid)
+        if multiprocess_metrics:
+            from prometheus_client import multiprocess
+
+            multiprocess.mark_process_dead(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited with status {status}, starting a new one.")
+            spawn()
+    sock.close()